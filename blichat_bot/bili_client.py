@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import asyncio
 from dataclasses import dataclass
 from typing import Awaitable, Callable
 
@@ -8,7 +7,7 @@ from blivedm import BLiveClient
 from blivedm.models import DanmakuMessage
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class DanmakuEvent:
     room_id: int
     uid: int
@@ -28,7 +27,6 @@ class BiliDanmakuClient(BLiveClient):
     def __init__(self, room_id: int, on_danmaku: DanmakuCallback | None = None) -> None:
         super().__init__(room_id)
         self._on_danmaku: DanmakuCallback | None = on_danmaku
-        self._closing = asyncio.Event()
 
     def set_danmaku_callback(self, cb: DanmakuCallback | None) -> None:
         self._on_danmaku = cb
@@ -39,17 +37,18 @@ class BiliDanmakuClient(BLiveClient):
         注意：应在外部事件循环中作为独立任务运行。
         """
 
-        # 连接并开始监听（blivedm 0.1.1 的 start 是同步方法）
+        # 连接并开始监听（blivedm 的 start 是同步方法），
+        # 直接等 blivedm 内部的网络任务结束，不再额外挂一个 Event
         self.start()
         try:
-            await self._closing.wait()
+            await self.join()
         finally:
             await self.close()
 
     def stop_gracefully(self) -> None:
-        """请求停止监听任务。"""
+        """请求停止监听任务，start_and_run_forever 里的 join 会随之返回。"""
 
-        self._closing.set()
+        self.stop()
 
     async def _on_danmaku_msg(  # type: ignore[override]
         self,
@@ -58,15 +57,11 @@ class BiliDanmakuClient(BLiveClient):
     ) -> None:
         """重写 blivedm 的弹幕回调，只往上抛我们关心的字段。"""
 
-        if not self._on_danmaku:
+        # 每条弹幕都会走到这里，回调只取一次属性
+        cb = self._on_danmaku
+        if cb is None:
             return
 
-        event = DanmakuEvent(
-            room_id=client.room_id,
-            uid=message.uid,
-            uname=message.uname,
-            text=message.msg,
-        )
-        await self._on_danmaku(event)
+        await cb(DanmakuEvent(client.room_id, message.uid, message.uname, message.msg))
 
 
@@ -1,19 +1,39 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
-from bilibili_api import Credential, live
+import aiohttp
+from bilibili_api import Credential, live, set_aiohttp_session, settings
 
 
-@dataclass
+# B 站对同一账号发弹幕有频率限制，两条弹幕之间至少间隔这么久（秒）
+MIN_SEND_INTERVAL = 1.0
+# 同时在途的发弹幕请求上限；节奏由时间片控制，这里只防止请求堆积过多
+MAX_IN_FLIGHT = 3
+
+
+def _new_http_session() -> aiohttp.ClientSession:
+    """给 bilibili-api 用的长连接会话，保持 keep-alive 省掉重复的 TLS 握手。"""
+
+    connector = aiohttp.TCPConnector(limit=8, keepalive_timeout=75, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector)
+
+
+@dataclass(slots=True)
 class BiliSender:
     """负责往 B 站直播间里丢弹幕的“小红心女王信使”"""
 
     room_id: int
     credential: Credential
-    _lock: asyncio.Lock
+    # 复用同一个 LiveRoom，省得每发一条弹幕都重新构造
+    _room: live.LiveRoom
+    # 下一条弹幕最早可以发出的时间点（loop.time() 时钟）
+    _next_slot: float = 0.0
+    _sem: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(MAX_IN_FLIGHT))
+    # 第一次发弹幕时才创建（ClientSession 需要在运行中的事件循环里构造）
+    _session: Optional[aiohttp.ClientSession] = None
 
     @classmethod
     def from_cookies(
@@ -28,37 +48,59 @@ class BiliSender:
             bili_jct=bili_jct,
             buvid3=buvid3,
         )
-        return cls(room_id=room_id, credential=cred, _lock=asyncio.Lock())
+        return cls(
+            room_id=room_id,
+            credential=cred,
+            _room=live.LiveRoom(room_id, credential=cred),
+        )
 
     async def _send(self, text: str) -> None:
-        """真正的发弹幕动作，加一层锁做最小限度的限流序列化。"""
+        """真正的发弹幕动作。
+
+        先预约一个发送时间片（两行之间没有 await，单线程下天然原子），
+        到点后最多允许 MAX_IN_FLIGHT 个请求同时在途，
+        避免一条慢请求把后面所有弹幕都堵住。
+        """
 
         if not text:
             return
 
-        async with self._lock:
-            room = live.LiveRoom(self.room_id, credential=self.credential)
+        now = asyncio.get_running_loop().time()
+        wait = max(0.0, self._next_slot - now)
+        self._next_slot = max(now, self._next_slot) + MIN_SEND_INTERVAL
+
+        if wait:
+            await asyncio.sleep(wait)
+
+        if self._session is None:
+            self._session = _new_http_session()
+            settings.http_client = settings.HTTPClient.AIOHTTP
+            set_aiohttp_session(self._session)
+
+        async with self._sem:
             # 把异常交给上层处理，不在这里吞
-            await room.send_danmu(text)
+            await self._room.send_danmu(text)
 
     async def send_plain(self, text: str) -> None:
-        """发送普通弹幕。"""
+        """发送普通弹幕。
 
-        await self._send(text.strip())
+        text 由调用方（TG 入口）负责去掉首尾空白，这里不再重复 strip。
+        """
+
+        await self._send(text)
 
     async def send_reply(self, target_username: str, text: str) -> None:
         """发送带 @ 的“回复”弹幕。
 
         目前采用简单的 @ 昵称方案，B 站并没有公开稳定的“回复某条弹幕” API。
+        text 由调用方保证已去掉首尾空白且非空。
         """
 
-        text = text.strip()
-        if not text:
-            return
-
-        prefix = f"@{target_username} "
-        await self._send(prefix + text)
-
-
+        await self._send(f"@{target_username} {text}")
 
+    async def close(self) -> None:
+        """关闭复用的 HTTP 会话，应在程序退出时调用。"""
 
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
 import os
+import re
 from dataclasses import dataclass
-from pathlib import Path
-from typing import List
 
 
 _DOTENV_LOADED = False
 
+# 每行一个 KEY=VALUE，值可以用单/双引号包起来，行尾允许 # 注释
+_ENV_RE = re.compile(
+    r"""^[ \t]*([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*"""
+    r"""(?:"([^"\n]*)"|'([^'\n]*)'|([^\n#]*?))[ \t]*(?:#[^\n]*)?\r?$""",
+    re.M,
+)
+
 
 def _load_dotenv(path: str = ".env") -> None:
     """从项目根目录加载 .env 到当前进程的环境变量。
@@ -23,31 +29,20 @@ def _load_dotenv(path: str = ".env") -> None:
 
     _DOTENV_LOADED = True
 
-    env_path = Path(path)
-    if not env_path.is_file():
-        return
-
+    # 直接 open，不存在 / 是目录 / 无权限都归到 OSError，省掉一次 stat 也没有竞态
     try:
-        content = env_path.read_text(encoding="utf-8")
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                m = _ENV_RE.match(line)
+                if m is None:
+                    continue
+                value = next(g for g in m.groups()[1:] if g is not None)
+                os.environ.setdefault(m.group(1), value)
     except OSError:
         return
 
-    for line in content.splitlines():
-        raw = line.strip()
-        if not raw or raw.startswith("#"):
-            continue
-        if "=" not in raw:
-            continue
-        key, value = raw.split("=", 1)
-        key = key.strip()
-        if not key:
-            continue
-        # 去掉包裹在引号里的值
-        value = value.strip().strip('"').strip("'")
-        os.environ.setdefault(key, value)
-
-
-@dataclass
+
+@dataclass(slots=True)
 class Config:
     """全局配置，从环境变量 / .env 中读取。
 
@@ -65,7 +60,7 @@ class Config:
 
     tg_bot_token: str
     tg_chat_id: int
-    tg_allowed_user_ids: List[int]
+    tg_allowed_user_ids: frozenset[int]
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -85,20 +80,15 @@ class Config:
         tg_chat_id = int(tg_chat_id_str)
 
         allowed_raw = os.getenv("TG_ALLOWED_USER_IDS", "")
-        allowed_ids: List[int] = []
-        for part in allowed_raw.split(","):
-            part = part.strip()
-            if not part:
-                continue
-            try:
-                allowed_ids.append(int(part))
-            except ValueError:
-                # 草，这谁在 TG_ALLOWED_USER_IDS 里塞了奇怪的东西，直接忽略
-                continue
+        parts = (part.strip() for part in allowed_raw.split(","))
+        # 草，这谁在 TG_ALLOWED_USER_IDS 里塞了奇怪的东西，不是整数的直接忽略
+        allowed_ids = frozenset(
+            int(part) for part in parts if part.removeprefix("-").isdecimal()
+        )
 
         if not allowed_ids:
             # 默认只允许 chat_id 本人操作，避免把直播间控制权交给疯帽子
-            allowed_ids.append(tg_chat_id)
+            allowed_ids = frozenset((tg_chat_id,))
 
         return cls(
             bili_room_id=bili_room_id,
@@ -111,3 +101,5 @@ class Config:
         )
 
 
+# 统一的配置入口，原先根目录下的 config.py 是这份文件的重复拷贝，已合并到这里
+load_config = Config.from_env
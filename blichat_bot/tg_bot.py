@@ -1,20 +1,32 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart
 from aiogram.types import Message, ReplyKeyboardRemove
+from loguru import logger
 
 from .config import Config
 from .bili_sender import BiliSender
 from .bili_client import DanmakuEvent
 
 
-@dataclass
+# 最多记住多少条“TG 消息 → 弹幕”映射，回复基本只针对最近的弹幕
+MAX_DANMAKU_INDEX = 2048
+
+# 转发队列：Telegram 单 bot 大约 30 条/秒的上限，刷屏时把相邻弹幕合并成一条发
+OUT_QUEUE_SIZE = 1000
+MAX_BATCH_SIZE = 10
+SEND_INTERVAL = 1 / 30
+
+
+@dataclass(slots=True)
 class DanmakuMeta:
     room_id: int
     uid: int
@@ -33,9 +45,18 @@ class TgBiliBridgeBot:
             default=DefaultBotProperties(parse_mode=ParseMode.HTML),
         )
         self._dp = Dispatcher()
+        # 转发循环 / 权限检查里反复用到，提前绑定好
+        self._send_message = self._bot.send_message
+        self._tg_chat_id = config.tg_chat_id
+        self._allowed_ids: frozenset[int] = frozenset(config.tg_allowed_user_ids)
 
         # 记录“TG 消息 ID → 弹幕元数据”，方便后续在回复时知道要 @ 谁
-        self._danmaku_index: Dict[int, DanmakuMeta] = {}
+        # 用 OrderedDict 做 LRU，避免直播间一热闹就无限涨内存
+        self._danmaku_index: OrderedDict[int, DanmakuMeta] = OrderedDict()
+        self._max_index = MAX_DANMAKU_INDEX
+
+        # 待转发到 TG 的弹幕，由 run() 里启动的单个消费者按节奏发出
+        self._out_q: asyncio.Queue[DanmakuEvent] = asyncio.Queue(maxsize=OUT_QUEUE_SIZE)
 
         self._register_handlers()
 
@@ -72,16 +93,14 @@ class TgBiliBridgeBot:
 
             # 如果这是对某条弹幕转发消息的“回复”，则在直播间 @ 原发送者
             if message.reply_to_message:
-                await self._handle_reply(message)
+                await self._handle_reply(message, text)
             else:
                 await self._bili_sender.send_plain(text)
 
     def _is_user_allowed(self, user_id: int | None) -> bool:
-        if user_id is None:
-            return False
-        return user_id in self._config.tg_allowed_user_ids
+        return user_id is not None and user_id in self._allowed_ids
 
-    async def _handle_reply(self, message: Message) -> None:
+    async def _handle_reply(self, message: Message, text: str) -> None:
         reply_to = message.reply_to_message
         if not reply_to:
             return
@@ -89,33 +108,66 @@ class TgBiliBridgeBot:
         meta = self._danmaku_index.get(reply_to.message_id)
         if not meta:
             # 草，这条回复找不到原始弹幕映射，只好当普通弹幕发
-            await self._bili_sender.send_plain(message.text or "")
+            await self._bili_sender.send_plain(text)
             return
 
-        await self._bili_sender.send_reply(meta.uname, message.text or "")
+        self._danmaku_index.move_to_end(reply_to.message_id)
+        await self._bili_sender.send_reply(meta.uname, text)
 
     async def send_danmaku_to_tg(self, event: DanmakuEvent) -> None:
-        """把一条 B 站弹幕转发到 Telegram，并记录映射。"""
+        """把一条 B 站弹幕放进转发队列，实际发送由 _forward_worker 负责。"""
 
-        text = f"[{event.uname}] {event.text}"
-        msg = await self._bot.send_message(
-            chat_id=self._config.tg_chat_id,
-            text=text,
-        )
-        self._danmaku_index[msg.message_id] = DanmakuMeta(
-            room_id=event.room_id,
-            uid=event.uid,
-            uname=event.uname,
-            text=event.text,
-        )
+        await self._out_q.put(event)
 
-    async def run(self) -> None:
-        """启动 Telegram Bot 的轮询。
+    async def _forward_worker(self) -> None:
+        """从队列里取弹幕转发到 Telegram，并记录映射。
 
-        注意：应在外部事件循环中作为任务调用，不要阻塞整个 loop。
+        队列里积压多条时合并成一条多行消息；合并消息只记住最后一条弹幕，
+        回复它就等于 @ 最新的那位。
         """
 
-        await self._dp.start_polling(self._bot, allowed_updates=None)
+        q = self._out_q
+        send = self._send_message
+        chat_id = self._tg_chat_id
+        while True:
+            batch = [await q.get()]
+            while len(batch) < MAX_BATCH_SIZE and not q.empty():
+                batch.append(q.get_nowait())
+
+            text = "\n".join(f"[{e.uname}] {e.text}" for e in batch)
+            try:
+                msg = await send(chat_id=chat_id, text=text)
+            except Exception:
+                # 发送失败就丢掉这一批，别让整个转发循环挂掉；
+                # 照样等一个发送间隔，TG 不可达时不至于全速把队列清空
+                logger.exception("转发到 Telegram 失败，丢弃 {} 条弹幕", len(batch))
+                await asyncio.sleep(SEND_INTERVAL)
+                continue
+
+            last = batch[-1]
+            self._danmaku_index[msg.message_id] = DanmakuMeta(
+                room_id=last.room_id,
+                uid=last.uid,
+                uname=last.uname,
+                text=last.text,
+            )
+            if len(self._danmaku_index) > self._max_index:
+                self._danmaku_index.popitem(last=False)
+
+            await asyncio.sleep(SEND_INTERVAL)
 
+    async def run(self) -> None:
+        """启动 Telegram Bot 的轮询和弹幕转发循环。
 
+        注意：应在外部事件循环中作为任务调用，不要阻塞整个 loop。
+        """
 
+        worker = asyncio.create_task(self._forward_worker())
+        try:
+            await self._dp.start_polling(self._bot, allowed_updates=None)
+        finally:
+            worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await worker
+            # 转发循环已停，B 站发送端复用的 HTTP 会话也该关了
+            await self._bili_sender.close()
@@ -4,6 +4,7 @@ BiliChat Bot 主程序入口
 """
 
 import asyncio
+import os
 import signal
 import sys
 from pathlib import Path
@@ -11,13 +12,24 @@ from pathlib import Path
 from loguru import logger
 
 from src.config import load_config
-from src.message_mapper import MessageMapper
-from src.bilibili_listener import BilibiliDanmakuListener
+from src.message_mapper import MessageMapper, UserInfo
+from src.bilibili_listener import BilibiliDanmakuListener, close_shared_session
 from src.bilibili_open_listener import BilibiliOpenLiveListener
 from src.bilibili_sender import BilibiliDanmakuSender
 from src.telegram_bot import TelegramBot
 
 
+# 日志格式使用静态字符串：loguru 在 add() 时一次性解析颜色标记并编译模板，
+# 之后每条日志只做格式化（传可调用对象反而会每条记录重新解析一次）
+_CONSOLE_LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
+    "<level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
+    "<level>{message}</level>"
+)
+_FILE_LOG_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} | {message}"
+
+
 class BotApplication:
     """
     Bot应用主类
@@ -41,18 +53,33 @@ class BotApplication:
         self._loop = None  # 保存运行中的事件循环引用
     
     def setup_logger(self) -> None:
-        """配置日志"""
+        """
+        配置日志
+        
+        环境变量：
+        - BLICHAT_LOG_LEVEL: 控制台日志级别，默认 INFO（高负载时可调到 WARNING）
+        - BLICHAT_LOG_COLOR: 设为 0 / false 关闭控制台彩色输出
+        - BLICHAT_FILE_LOG_LEVEL: 文件日志级别，默认 DEBUG
+        
+        两个输出都高于 DEBUG 时，loguru 在 debug() 调用入口按最低级别直接返回，
+        弹幕热路径上的调试日志不再产生任何格式化开销
+        """
         logger.remove()  # 移除默认处理器
         
+        console_level = os.getenv("BLICHAT_LOG_LEVEL", "INFO").upper()
+        file_level = os.getenv("BLICHAT_FILE_LOG_LEVEL", "DEBUG").upper()
+        console_color = os.getenv("BLICHAT_LOG_COLOR", "1").lower() not in ("0", "false", "no")
+        
         # 控制台输出
+        # enqueue=True：日志经队列由后台线程写出，写 stderr / 磁盘不阻塞事件循环
         logger.add(
             sys.stderr,
-            format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
-                   "<level>{level: <8}</level> | "
-                   "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
-                   "<level>{message}</level>",
-            level="INFO",
-            colorize=True,
+            format=_CONSOLE_LOG_FORMAT,
+            level=console_level,
+            colorize=console_color,
+            enqueue=True,
+            backtrace=False,
+            diagnose=False,
         )
         
         # 文件输出
@@ -61,11 +88,14 @@ class BotApplication:
         
         logger.add(
             log_dir / "blichat_{time:YYYY-MM-DD}.log",
-            format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} | {message}",
-            level="DEBUG",
+            format=_FILE_LOG_FORMAT,
+            level=file_level,
             rotation="00:00",  # 每天零点轮转
             retention="7 days",  # 保留7天
             encoding="utf-8",
+            enqueue=True,
+            backtrace=False,
+            diagnose=False,
         )
         
         logger.info("日志系统初始化完成")
@@ -76,18 +106,43 @@ class BotApplication:
         
         注意：此方法必须在 run() 内部调用，确保 self._loop 和 self._shutdown_event 已初始化
         """
-        def signal_handler(sig, frame):
+        # 注册时就把循环和关闭事件绑定到闭包里，信号到来时不再查找事件循环
+        loop = self._loop
+        shutdown_event = self._shutdown_event
+        
+        # POSIX：直接由事件循环在自身线程里调度回调，无需跨线程投递
+        def on_signal(sig: signal.Signals) -> None:
+            logger.warning(f"收到信号 {sig}，准备关闭...")
+            shutdown_event.set()
+            if sig == signal.SIGINT:
+                # 第二次 Ctrl-C 直接走系统默认处理，优雅关闭卡住时也能立即退出
+                loop.remove_signal_handler(signal.SIGINT)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+        
+        try:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, on_signal, sig)
+        except NotImplementedError:
+            # Windows 等不支持 add_signal_handler 的事件循环，退回 signal.signal
+            pass
+        else:
+            logger.debug("信号处理器注册完成")
+            return
+        
+        def signal_handler(sig, *_):
             logger.warning(f"收到信号 {sig}，准备关闭...")
-            # 使用保存的事件循环引用进行线程安全操作
+            if sig == signal.SIGINT:
+                # 第二次 Ctrl-C 直接走系统默认处理，优雅关闭卡住时也能立即退出
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # 使用注册时捕获的事件循环引用进行线程安全操作
             # 因为信号处理器在主线程中执行，而 asyncio.Event 需要在事件循环线程中操作
-            if self._loop and not self._loop.is_closed():
-                self._loop.call_soon_threadsafe(self._shutdown_event.set)
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(shutdown_event.set)
             else:
                 # 极端情况：循环已关闭（理论上不应该发生）
                 logger.error("无法设置关闭事件：事件循环已关闭")
         
         signal.signal(signal.SIGINT, signal_handler)
-        # Windows 兼容：只在支持 SIGTERM 的平台上注册
         if hasattr(signal, 'SIGTERM'):
             signal.signal(signal.SIGTERM, signal_handler)
         
@@ -111,6 +166,8 @@ class BotApplication:
         # 初始化消息映射器
         logger.info("🗺️ 初始化消息映射器...")
         self.mapper = MessageMapper(max_size=self.config.bot.message_cache_size)
+        if self.config.bot.message_cache_file:
+            self.mapper.load(Path(self.config.bot.message_cache_file))
         
         # 初始化B站发送器（启用自动刷新）
         logger.info("📤 初始化B站弹幕发送器...")
@@ -120,35 +177,48 @@ class BotApplication:
             full_config=self.config,  # 传入完整配置以支持自动刷新
             config_path=Path("config.yaml"),
             enable_auto_refresh=True,  # 启用自动刷新
+            coalesce=self.config.bot.danmaku_coalesce,
         )
         
-        # 测试B站连接
-        logger.info("🔗 测试B站连接...")
-        if not await self.bili_sender.test_connection():
-            logger.error("❌ B站连接测试失败，请检查Cookie是否正确")
-            raise RuntimeError("B站连接失败")
-        
-        # 初始化TG Bot
+        # 初始化TG Bot（构造本身很便宜，网络部分在下面的预检里）
         logger.info("🤖 初始化Telegram Bot...")
         self.tg_bot = TelegramBot(
             config=self.config.telegram,
             bili_sender=self.bili_sender,
             message_mapper=self.mapper,
+            batch_ms=self.config.bot.telegram_batch_ms,
+        )
+        
+        # B站连接测试和TG预检访问的是两个互不相关的服务，并发进行
+        logger.info("🔗 测试B站连接...")
+        # return_exceptions：一边失败时也要等另一边跑完，否则它会在清理之后继续运行
+        # （刷新凭证、写配置、启动定期检查），再把异常抛出去
+        bili_ok, tg_err = await asyncio.gather(
+            self.bili_sender.test_connection(),
+            self.tg_bot.preflight(),
+            return_exceptions=True,
         )
+        for result in (bili_ok, tg_err):
+            if isinstance(result, BaseException):
+                raise result
+        if not bili_ok:
+            logger.error("❌ B站连接测试失败，请检查Cookie是否正确")
+            raise RuntimeError("B站连接失败")
 
         # 初始化B站监听器（根据配置选择）
         bili_cfg = self.config.bilibili
-        if getattr(bili_cfg, "use_blive_chat", False):
+        if bili_cfg.use_blive_chat:
             # 模式三：通过 blive.chat 代理 Open Live：
             # - 普通弹幕 + SC 走 blive.chat Open Live（完整用户名）
-            # - 进场/关注等系统消息仍走 Web 监听器，但只转发 [系统消息]
+            # - 进场/关注等系统消息仍走 Web 监听器，普通弹幕 / SC 在监听器源头丢弃
             from src.blivechat_open_listener import BliveChatOpenLiveListener
 
             logger.info("📡 初始化B站Web弹幕监听器（仅系统消息）...")
             self.web_system_listener = BilibiliDanmakuListener(
                 config=bili_cfg,
-                on_danmaku=self._on_system_message_from_web,
+                on_danmaku=self._on_danmaku_received,
                 filter_system=self.config.bot.filter_system_message,
+                only_system=True,
             )
 
             logger.info("📡 初始化Blive.chat Open Live弹幕监听器（完整用户名模式）...")
@@ -174,7 +244,15 @@ class BotApplication:
         
         logger.success("✅ 所有组件初始化完成")
     
-    async def _on_danmaku_received(self, user_id: int, uid_crc32: str, username: str, content: str, user_info: dict) -> None:
+    async def _on_danmaku_received(
+        self,
+        user_id: int,
+        uid_crc32: str,
+        username: str,
+        content: str,
+        user_info: UserInfo,
+        is_system: bool = False,
+    ) -> None:
         """
         弹幕接收回调
         
@@ -184,30 +262,15 @@ class BotApplication:
             username: 用户名
             content: 弹幕内容
             user_info: 扩展用户信息
+            is_system: 是否为系统消息（进场、礼物等），由监听器在产生消息时标记
         """
         # 过滤自身弹幕（避免“回声”被再次转发到TG）
         if self.bili_sender and self.bili_sender.is_self_message(user_id, username, content):
             logger.debug("忽略自身弹幕回显")
             return
         # 转发到TG
-        await self.tg_bot.forward_danmaku(user_id, uid_crc32, username, content, user_info)
+        await self.tg_bot.forward_danmaku(user_id, uid_crc32, username, content, user_info, is_system)
 
-    async def _on_system_message_from_web(
-        self,
-        user_id: int,
-        uid_crc32: str,
-        username: str,
-        content: str,
-        user_info: dict,
-    ) -> None:
-        """
-        Web 弹幕监听器专用回调：只转发系统消息（[系统消息] 开头），避免与 Open Live 弹幕重复。
-        """
-        if not content.startswith("[系统消息]"):
-            # 普通弹幕 / SC 由 Open Live 负责，这里直接丢弃
-            return
-        await self._on_danmaku_received(user_id, uid_crc32, username, content, user_info)
-    
     async def start(self) -> asyncio.Task:
         """
         启动所有服务
@@ -249,6 +312,49 @@ class BotApplication:
         """
         await self._cleanup_components(listener_task)
     
+    async def _stop_listener(self, listener, task: asyncio.Task | None, name: str) -> None:
+        """停止一个B站监听器（可能为 None）并等待其后台任务结束，超时则强制取消"""
+        if not listener:
+            return
+        try:
+            logger.info(f"📡 停止{name}...")
+            await listener.stop()
+            
+            # 等待监听任务完成（如果任务存在）
+            if task is not None:
+                try:
+                    await asyncio.wait_for(task, timeout=5.0)
+                except asyncio.TimeoutError:
+                    logger.warning(f"{name}停止超时，强制取消")
+                    task.cancel()
+                    # 等待任务清理资源（防止资源泄漏）
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+        except Exception as e:
+            logger.error(f"停止{name}时出错：{e}", exc_info=True)
+    
+    async def _stop_tg_bot(self) -> None:
+        """停止TG Bot（如果已创建）"""
+        if not self.tg_bot:
+            return
+        try:
+            logger.info("🤖 停止Telegram Bot...")
+            await self.tg_bot.stop()
+        except Exception as e:
+            logger.error(f"停止TG Bot时出错：{e}", exc_info=True)
+    
+    async def _stop_sender(self) -> None:
+        """停止B站发送器的后台任务（凭证自动刷新，如果已启用）"""
+        if not (self.bili_sender and self.bili_sender.refresher):
+            return
+        try:
+            logger.info("⏹️ 停止凭证自动刷新任务...")
+            await self.bili_sender.stop()
+        except Exception as e:
+            logger.error(f"停止刷新器时出错：{e}", exc_info=True)
+    
     async def _cleanup_components(self, listener_task: asyncio.Task = None) -> None:
         """
         清理所有已初始化的组件
@@ -263,66 +369,30 @@ class BotApplication:
         logger.info("🛑 正在关闭所有服务...")
         logger.info("="*60)
         
-        # 停止B站监听器（如果已创建）
-        if self.bili_listener:
-            try:
-                logger.info("📡 停止弹幕监听器...")
-                await self.bili_listener.stop()
-                
-                # 等待监听任务完成（如果任务存在）
-                if listener_task:
-                    try:
-                        await asyncio.wait_for(listener_task, timeout=5.0)
-                    except asyncio.TimeoutError:
-                        logger.warning("监听器停止超时，强制取消")
-                        listener_task.cancel()
-                        # 等待任务清理资源（防止资源泄漏）
-                        try:
-                            await listener_task
-                        except asyncio.CancelledError:
-                            pass
-            except Exception as e:
-                logger.error(f"停止监听器时出错：{e}", exc_info=True)
-
-        # 停止仅用于系统消息的 Web 监听器（如果存在）
-        if self.web_system_listener:
-            try:
-                logger.info("📡 停止Web系统消息监听器...")
-                await self.web_system_listener.stop()
-
-                web_task = getattr(self, "_web_system_task", None)
-                if web_task is not None:
-                    try:
-                        await asyncio.wait_for(web_task, timeout=5.0)
-                    except asyncio.TimeoutError:
-                        logger.warning("Web系统消息监听器停止超时，强制取消")
-                        web_task.cancel()
-                        try:
-                            await web_task
-                        except asyncio.CancelledError:
-                            pass
-            except Exception as e:
-                logger.error(f"停止Web系统消息监听器时出错：{e}", exc_info=True)
-        
-        # 停止TG Bot（如果已创建）
-        if self.tg_bot:
-            try:
-                logger.info("🤖 停止Telegram Bot...")
-                await self.tg_bot.stop()
-            except Exception as e:
-                logger.error(f"停止TG Bot时出错：{e}", exc_info=True)
+        # 监听器和发送器相互独立，并发停止：总耗时取决于最慢的一个，而不是逐个超时累加
+        await asyncio.gather(
+            self._stop_listener(self.bili_listener, listener_task, "弹幕监听器"),
+            self._stop_listener(
+                self.web_system_listener,
+                getattr(self, "_web_system_task", None),
+                "Web系统消息监听器",
+            ),
+            self._stop_sender(),
+        )
+        # 监听器停止时会把队列里剩下的弹幕转发到TG，TG Bot 必须等它们排空后再停
+        await self._stop_tg_bot()
         
-        # 停止凭证刷新器（如果已启用）
-        if self.bili_sender and self.bili_sender.refresher:
-            try:
-                logger.info("⏹️ 停止凭证自动刷新任务...")
-                await self.bili_sender.refresher.stop_periodic_check()
-            except Exception as e:
-                logger.error(f"停止刷新器时出错：{e}", exc_info=True)
+        # 监听器都已停止，关闭它们共用的 HTTP 会话
+        try:
+            await close_shared_session()
+        except Exception as e:
+            logger.error(f"关闭共享HTTP会话时出错：{e}", exc_info=True)
         
-        # 清理映射缓存（如果已创建）
+        # 清理映射缓存（如果已创建）；开启持久化时先保存，下次启动恢复
         if self.mapper:
             try:
+                if self.config and self.config.bot.message_cache_file:
+                    self.mapper.save(Path(self.config.bot.message_cache_file))
                 self.mapper.clear()
             except Exception as e:
                 logger.error(f"清理映射缓存时出错：{e}", exc_info=True)
@@ -330,11 +400,16 @@ class BotApplication:
         logger.success("="*60)
         logger.success("👋 BiliChat Bot 已安全关闭，下次再见~")
         logger.success("="*60)
+        
+        # 等待后台日志队列写完，避免退出时丢失最后几条日志
+        await logger.complete()
     
     async def run(self) -> None:
         """主运行流程"""
         # 在协程中安全获取当前运行的事件循环
         self._loop = asyncio.get_running_loop()
+        loop_cls = type(self._loop)
+        logger.debug(f"事件循环实现：{loop_cls.__module__}.{loop_cls.__qualname__}")
         
         # 在循环运行后创建 Event 对象
         self._shutdown_event = asyncio.Event()
@@ -359,6 +434,36 @@ class BotApplication:
             logger.info("程序退出")
 
 
+def run_event_loop(coro) -> None:
+    """
+    运行主协程，优先使用 libuv 实现的事件循环（socket 密集场景更快）：
+    POSIX 用 uvloop，Windows 用 winloop
+
+    都未安装时回退到 asyncio 默认事件循环；
+    设置环境变量 BLICHAT_EVENT_LOOP=asyncio 可强制使用默认事件循环（便于排查问题）
+    """
+    if os.getenv("BLICHAT_EVENT_LOOP", "auto").lower() == "asyncio":
+        asyncio.run(coro)
+        return
+    
+    try:
+        if sys.platform == "win32":
+            import winloop as fast_loop
+        else:
+            import uvloop as fast_loop
+    except ImportError:
+        asyncio.run(coro)
+        return
+
+    if sys.version_info >= (3, 11):
+        # 直接指定循环工厂，不修改全局事件循环策略
+        with asyncio.Runner(loop_factory=fast_loop.new_event_loop) as runner:
+            runner.run(coro)
+    else:
+        fast_loop.install()
+        asyncio.run(coro)
+
+
 async def main():
     """异步主函数"""
     app = BotApplication()
@@ -372,7 +477,7 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        run_event_loop(main())
     except KeyboardInterrupt:
         print("\n程序已终止")
     except Exception as e:
@@ -5,14 +5,99 @@ B站直播弹幕监听器 - 仙境入口守望者
 
 import asyncio
 import dataclasses
+import enum
 import re
-from typing import Callable, Awaitable, Any
+from typing import Callable, Awaitable, Any, Final, Optional
 
+import aiohttp
 import blivedm
 from blivedm.models import web
 from loguru import logger
 
 from .config import BilibiliConfig
+from .message_mapper import UserInfo
+
+
+# 弹幕回调队列容量与消费者数量：回调排队交给常驻 worker 执行，不再每条弹幕建一个 Task
+_QUEUE_MAXSIZE: Final[int] = 4096
+_WORKER_COUNT: Final[int] = 4
+# 单次回调的超时（秒）：下游（Telegram 等）卡住时不让 worker 一直被占住
+_CALLBACK_TIMEOUT: Final[float] = 30.0
+
+# 系统消息前缀，以及合并转发时单批最多合并的条数
+_SYSTEM_PREFIX: Final[str] = "[系统消息]"
+_SYSTEM_BATCH_SIZE: Final[int] = 10
+
+# SC 转发内容的价格前缀（各监听器共用）
+_SC_PREFIX: Final[str] = "💰¥"
+
+# 连接断开后的重连退避上限（秒）
+_RECONNECT_MAX_DELAY: Final[float] = 60.0
+
+# 系统消息共用的空用户信息（UserInfo 不可变，所有消息共享同一个实例）
+_EMPTY_USER_INFO: Final[UserInfo] = UserInfo()
+
+
+def _medal_user_info(medal_name: str, medal_level: int) -> UserInfo:
+    """只带粉丝牌的用户信息；未佩戴粉丝牌（最常见）时直接复用共享的空实例，不再新建"""
+    if not medal_name:
+        return _EMPTY_USER_INFO
+    # 按位置传参（user_level 恒为 0），比关键字参数少一次参数绑定
+    return UserInfo(0, medal_name, medal_level)
+
+
+# 互动消息 msg_type → 文案：1进入, 2关注, 3分享, 4特别关注, 5互粉, 6点赞
+_MSG_TYPE_STR = {
+    1: "进入直播间",
+    2: "关注了直播间",
+    3: "分享了直播间",
+    4: "特别关注了直播间",
+    5: "互粉了直播间",
+    6: "点赞了直播间",
+}
+
+# 进场特效文案中的用户名占位符 <%...%>，以及从文案里提取用户名的模式
+# 例如 "欢迎 舰长 <%User%> 进入直播间" / "欢迎舰长User进入直播间"
+_PLACEHOLDER_RE = re.compile(r"<%.*?%>")
+_ENTRY_RE = re.compile(
+    r"欢迎\s*(?:舰长|提督|总督)?\s*<?%?(?P<name>[^%<>]+?)%?>?\s*进入直播间"
+)
+
+
+# Web 监听器共用的 HTTP 会话：重连新建的客户端复用同一个连接池和 DNS 缓存，
+# 不再每个客户端各自创建会话、重新握手。会话生命周期长于单个监听器，进程退出前调用 close_shared_session()
+_shared_session: aiohttp.ClientSession | None = None
+_READ_BUFSIZE: Final[int] = 2 ** 18
+
+
+def _get_shared_session() -> aiohttp.ClientSession:
+    """获取（必要时创建）共用的 HTTP 会话，须在事件循环中调用"""
+    global _shared_session
+    if _shared_session is None or _shared_session.closed:
+        # TCP_NODELAY 不必手动设置：asyncio / uvloop 创建 TCP 传输时默认就会关闭 Nagle
+        _shared_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=75),
+            # 更大的读缓冲：突发刷屏时单次读取更多数据，减少唤醒次数
+            read_bufsize=_READ_BUFSIZE,
+            # 与 blivedm 自建会话时一致；不设置会退回 aiohttp 默认的 300 秒，重连时可能卡住好几分钟
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+    return _shared_session
+
+
+async def close_shared_session() -> None:
+    """关闭共用的 HTTP 会话（未创建时什么也不做）"""
+    global _shared_session
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+    _shared_session = None
+
+
+class _ListenerState(enum.Enum):
+    """监听器运行状态"""
+    IDLE = "idle"
+    RUNNING = "running"
+    STOPPING = "stopping"
 
 
 @dataclasses.dataclass
@@ -64,6 +149,79 @@ class EntryEffectMessage:
         )
 
 
+class SystemMessageBatcher:
+    """
+    系统消息合并器
+    
+    开启合并窗口时先放入缓冲：窗口到期或攒满一批后合并成一条再转发，
+    避免进场/关注/礼物刷屏时每条都单独推送到 TG
+    """
+    
+    __slots__ = ("_dispatch", "_delay", "_buffer", "_flush_task")
+    
+    def __init__(self, dispatch: Callable[..., None], batch_ms: int = 0):
+        """
+        Args:
+            dispatch: 转发函数，参数与弹幕回调一致 (user_id, uid_crc32, username, content, user_info, is_system)
+            batch_ms: 合并窗口（毫秒），0 表示不合并、逐条转发
+        """
+        self._dispatch = dispatch
+        self._delay = batch_ms / 1000
+        # 合并缓冲：(uid, username, content, user_info)
+        self._buffer: list[tuple] = []
+        # 定时转发任务；这个属性同时是它的强引用（事件循环只持有弱引用），
+        # 必须等任务开始转发时才清空
+        self._flush_task: asyncio.Task | None = None
+    
+    def add(
+        self,
+        uid: int,
+        username: str,
+        content: str,
+        user_info: UserInfo = _EMPTY_USER_INFO,
+    ) -> None:
+        """放入一条系统消息（content 以系统消息前缀开头）"""
+        if self._delay <= 0:
+            self._dispatch(uid, "", username, content, user_info, True)
+            return
+        
+        self._buffer.append((uid, username, content, user_info))
+        if len(self._buffer) >= _SYSTEM_BATCH_SIZE:
+            self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after(self._delay))
+    
+    async def _flush_after(self, delay: float) -> None:
+        """等待合并窗口结束后转发缓冲中的系统消息"""
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        self.flush()
+    
+    def flush(self) -> None:
+        """立即转发缓冲中的系统消息（多条时合并为一条）"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        
+        buffer = self._buffer
+        if not buffer:
+            return
+        self._buffer = []
+        
+        if len(buffer) == 1:
+            uid, username, content, user_info = buffer[0]
+        else:
+            # 合并消息的映射指向最后一位用户
+            uid, username, _, _ = buffer[-1]
+            lines = "\n".join(
+                item[2].removeprefix(_SYSTEM_PREFIX).lstrip() for item in buffer
+            )
+            content = f"{_SYSTEM_PREFIX} ×{len(buffer)}\n{lines}"
+            user_info = _EMPTY_USER_INFO
+        
+        self._dispatch(uid, "", username, content, user_info, True)
+
+
 class BilibiliDanmakuListener:
     """
     B站弹幕监听器
@@ -72,105 +230,361 @@ class BilibiliDanmakuListener:
     过滤掉系统消息（进场、关注等），只保留真实弹幕
     """
     
+    __slots__ = (
+        "config", "on_danmaku", "filter_system", "only_system", "handler", "client",
+        "_state", "_running_evt", "_stopped_evt", "_stop_requested",
+    )
+    
     def __init__(
         self,
         config: BilibiliConfig,
-        on_danmaku: Callable[[int, str, str, str, dict], Awaitable[None]],
+        on_danmaku: Callable[[int, str, str, str, UserInfo, bool], Awaitable[None]],
         filter_system: bool = True,
+        only_system: bool = False,
     ):
         """
         Args:
             config: B站配置
-            on_danmaku: 弹幕回调函数 (user_id, username, content) -> None
+            on_danmaku: 弹幕回调函数 (user_id, uid_crc32, username, content, user_info, is_system) -> None
             filter_system: 是否过滤系统消息
+            only_system: 只处理系统消息，普通弹幕 / SC 在源头直接丢弃（弹幕由其他监听器负责时使用）
         """
         self.config = config
         self.on_danmaku = on_danmaku
         self.filter_system = filter_system
-        
-        # 创建blivedm客户端
-        self.client = blivedm.BLiveClient(
-            room_id=config.room_id,
-            session=None,  # 使用默认session
-        )
+        self.only_system = only_system
         
         # 注册处理器
         self.handler = DanmakuHandler(
             on_danmaku=on_danmaku,
             filter_system=filter_system,
+            system_batch_ms=config.system_message_batch_ms,
+            only_system=only_system,
+            queue_size=config.callback_queue_size,
+            worker_count=config.callback_workers,
         )
-        self.client.set_handler(self.handler)
         
-        self._running = False
+        # 创建blivedm客户端
+        self.client = self._create_client()
+        
+        self._state = _ListenerState.IDLE
+        # 运行/停止事件：调用方可直接等待状态变化，无需轮询
+        self._running_evt = asyncio.Event()
+        self._stopped_evt = asyncio.Event()
+        self._stopped_evt.set()
+        # 停止请求：打断重连前的退避等待
+        self._stop_requested = asyncio.Event()
         logger.info(f"弹幕监听器初始化完成，目标房间：{config.room_id}")
     
+    def _create_client(self) -> blivedm.BLiveClient:
+        """创建并绑定处理器的 blivedm 客户端（客户端不可重复 start，重连时需新建）"""
+        client = blivedm.BLiveClient(
+            room_id=self.config.room_id,
+            # 外部传入的会话不归客户端所有，stop_and_close() 不会关闭它
+            session=_get_shared_session(),
+        )
+        client.set_handler(self.handler)
+        return client
+    
     async def start(self) -> None:
-        """启动监听"""
-        if self._running:
+        """启动监听（连接断开时按指数退避自动重连，直到 stop() 被调用）"""
+        if self._state is not _ListenerState.IDLE:
             logger.warning("监听器已在运行中，忽略重复启动")
             return
         
-        self._running = True
+        self._state = _ListenerState.RUNNING
+        self._stopped_evt.clear()
+        self._stop_requested.clear()
+        self._running_evt.set()
         logger.info(f"开始监听直播间 {self.config.room_id} 的弹幕...")
         
+        # 回调 worker 的生命周期与监听保持一致：在这里启动，stop() 时排空并回收
+        self.handler.start_workers()
+        
+        attempt = 0
         try:
-            # 启动客户端
-            self.client.start()
-            # 等待客户端结束（会阻塞直到停止）
-            await self.client.join()
-        except Exception as e:
-            logger.error(f"弹幕监听异常：{e}")
-            raise
+            while self._state is _ListenerState.RUNNING:
+                try:
+                    # 启动客户端
+                    self.client.start()
+                    # 等待客户端结束（会阻塞直到停止或断线）
+                    await self.client.join()
+                    attempt = 0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"弹幕监听异常：{e}")
+                
+                if self._state is not _ListenerState.RUNNING:
+                    break
+                
+                # 非主动停止却退出了：关闭旧客户端，退避后用新客户端重连
+                delay = min(_RECONNECT_MAX_DELAY, 2 ** attempt)
+                attempt += 1
+                logger.warning(f"弹幕连接已断开，{delay:.0f} 秒后进行第 {attempt} 次重连...")
+                try:
+                    await self.client.stop_and_close()
+                except Exception as e:
+                    logger.warning(f"关闭旧的弹幕客户端时出错：{e}")
+                # 等待退避时间；期间 stop() 会置位停止请求，立即结束等待
+                try:
+                    await asyncio.wait_for(self._stop_requested.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                if self._state is _ListenerState.RUNNING:
+                    self.client = self._create_client()
         finally:
-            self._running = False
+            self._state = _ListenerState.IDLE
+            self._running_evt.clear()
+            self._stopped_evt.set()
             logger.info("弹幕监听已停止")
     
     async def stop(self) -> None:
         """停止监听"""
-        if not self._running:
+        if self._state is not _ListenerState.RUNNING:
             logger.warning("监听器未运行，忽略停止请求")
             return
         
         logger.info("正在停止弹幕监听...")
+        # 先切换到停止中，避免 start() 把这次退出当成断线去重连
+        self._state = _ListenerState.STOPPING
+        self._stop_requested.set()
         # client.stop() 不返回awaitable，直接调用
         self.client.stop()
         
         # 等待所有待处理的弹幕回调任务完成（避免资源泄漏）
         await self.handler.wait_all_tasks(timeout=3.0)
         
-        # 等待客户端完全停止
-        await asyncio.sleep(0.5)
+        # 等待客户端完全停止（start() 退出时会置位，而不是固定睡眠）
+        try:
+            await asyncio.wait_for(self._stopped_evt.wait(), timeout=2.0)
+        except asyncio.TimeoutError:
+            logger.warning("等待弹幕客户端停止超时")
     
     @property
     def is_running(self) -> bool:
         """是否正在运行"""
-        return self._running
+        return self._state is _ListenerState.RUNNING
+    
+    async def wait_running(self) -> None:
+        """等待监听器进入运行状态"""
+        await self._running_evt.wait()
+    
+    async def wait_stopped(self) -> None:
+        """等待监听器完全停止（未启动时立即返回）"""
+        await self._stopped_evt.wait()
 
 
-class DanmakuHandler(blivedm.BaseHandler):
+class DanmakuCallbackQueue:
     """
-    弹幕处理器
+    弹幕回调队列
+    
+    回调参数放入有界队列，由固定数量的常驻 worker 依次调用回调，
+    不再每条弹幕创建一个 Task。是否处理完由队列自身的未完成计数判断（join），
+    无需逐条跟踪任务
+    """
+    
+    __slots__ = ("_callback", "_queue", "_worker_count", "_timeout", "_workers")
+    
+    def __init__(
+        self,
+        callback: Callable[..., Awaitable[None]],
+        maxsize: int = _QUEUE_MAXSIZE,
+        worker_count: int = _WORKER_COUNT,
+        timeout: Optional[float] = _CALLBACK_TIMEOUT,
+    ):
+        """
+        Args:
+            callback: 弹幕回调协程函数，put() 的参数原样传给它
+            maxsize: 队列容量，满了之后新消息直接丢弃
+            worker_count: 常驻 worker 数量
+            timeout: 单次回调超时（秒），超时的回调会被取消；None 表示不限制
+        """
+        self._callback = callback
+        self._timeout: Optional[float] = timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._worker_count: int = max(1, worker_count)
+        # 事件循环只持有任务的弱引用，worker 必须由这里强引用（不能换成 WeakSet），
+        # 否则空闲等待中的 worker 可能被 GC 回收
+        self._workers: list[asyncio.Task] = []
+    
+    def start(self) -> None:
+        """启动固定数量的回调 worker（已启动则忽略）"""
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self._worker_count)
+        ]
+    
+    def put(self, *args: Any) -> None:
+        """把一次弹幕回调的参数放入队列，队列满时丢弃并记录（背压）"""
+        try:
+            self._queue.put_nowait(args)
+        except asyncio.QueueFull:
+            logger.warning("弹幕回调队列已满（{}），丢弃一条消息", self._queue.maxsize)
+    
+    async def _worker(self) -> None:
+        """常驻消费者：依次取出回调参数并调用回调"""
+        while True:
+            args = await self._queue.get()
+            try:
+                if self._timeout is None:
+                    await self._callback(*args)
+                else:
+                    await asyncio.wait_for(self._callback(*args), timeout=self._timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ 弹幕回调超过 {} 秒未完成，已取消", self._timeout)
+            except Exception as e:
+                logger.error("回调异常：{}", e)
+            finally:
+                self._queue.task_done()
+    
+    async def drain(self, timeout: float = 5.0) -> None:
+        """
+        等待队列中所有待处理的回调完成，然后停止 worker
+        
+        Args:
+            timeout: 等待超时时间（秒），超时后强制取消剩余回调
+        """
+        if not self._workers:
+            logger.debug("没有待处理的弹幕任务")
+            return
+        
+        queued = self._queue.qsize()
+        logger.info(f"等待队列中 {queued} 条弹幕回调处理完成...")
+        
+        # 队列排空与 worker 一起等待：worker 意外退出时立即结束等待，
+        # 不会因为没人消费而一直等到超时
+        join_task = asyncio.ensure_future(self._queue.join())
+        try:
+            done, _ = await asyncio.wait(
+                (join_task, *self._workers),
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if join_task in done:
+                logger.success("✅ 弹幕回调队列已清空")
+            elif done:
+                logger.error(f"❌ 回调 worker 意外退出，放弃剩余 {self._queue.qsize()} 条回调")
+            else:
+                logger.warning(f"⚠️ 等待超时，强制取消剩余 {self._queue.qsize()} 条回调")
+        finally:
+            # 停止所有 worker（正在执行的回调一并取消），并等待它们真正结束
+            join_task.cancel()
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(join_task, *self._workers, return_exceptions=True)
+            self._workers = []
+
+
+class QueuedDanmakuHandler(blivedm.BaseHandler):
+    """
+    弹幕处理器基类（Web / Open Live 共用）
     
-    继承自blivedm的BaseHandler，处理各类直播间消息
+    消息回调参数放入有界队列，由固定数量的常驻 worker 调用 on_danmaku；
+    系统消息先经过合并器再入队
     """
     
+    # blivedm.BaseHandler 没有 __slots__，实例仍保留 __dict__（only_system 会在实例上覆盖回调表），
+    # 这里只把热路径上的属性放进槽位
+    __slots__ = (
+        "on_danmaku", "filter_system", "_callbacks", "_dispatch", "_system_batcher",
+    )
+    
     def __init__(
         self,
-        on_danmaku: Callable[[int, str, str, str, dict], Awaitable[None]],
+        on_danmaku: Callable[[int, str, str, str, UserInfo, bool], Awaitable[None]],
         filter_system: bool = True,
+        system_batch_ms: int = 0,
+        queue_size: int = _QUEUE_MAXSIZE,
+        worker_count: int = _WORKER_COUNT,
     ):
+        """
+        Args:
+            on_danmaku: 弹幕回调函数，最后一个参数 is_system 标记是否为系统消息
+            filter_system: 是否过滤系统消息
+            system_batch_ms: 系统消息合并窗口（毫秒），窗口内的多条系统消息合并为一条转发，0 表示不合并
+            queue_size: 弹幕回调队列容量
+            worker_count: 调用弹幕回调的 worker 数量
+        """
         super().__init__()
-        self.on_danmaku = on_danmaku
-        self.filter_system = filter_system
-        # 跟踪所有待处理的异步任务（防止关闭时被强制取消）
-        self._pending_tasks: set = set()
+        self.on_danmaku: Callable[[int, str, str, str, UserInfo, bool], Awaitable[None]] = on_danmaku
+        self.filter_system: bool = filter_system
+        # 弹幕回调队列；_dispatch 直接绑定到队列的 put，热路径上少一层调用
+        self._callbacks = DanmakuCallbackQueue(on_danmaku, queue_size, worker_count)
+        self._dispatch: Callable[..., None] = self._callbacks.put
+        # 系统消息合并器：窗口内的多条系统消息合并后再放入回调队列
+        self._system_batcher = SystemMessageBatcher(self._dispatch, system_batch_ms)
+    
+    def start_workers(self) -> None:
+        """启动回调 worker（已启动则忽略）"""
+        self._callbacks.start()
+    
+    def _emit_system_content(
+        self,
+        uid: int,
+        username: str,
+        content: str,
+        user_info: UserInfo = _EMPTY_USER_INFO,
+    ) -> None:
+        """转发一条系统消息（开启合并窗口时先交给合并器）"""
+        self._system_batcher.add(uid, username, content, user_info)
+    
+    def _flush_system(self) -> None:
+        """立即转发合并器中缓冲的系统消息"""
+        self._system_batcher.flush()
+    
+    async def wait_all_tasks(self, timeout: float = 5.0) -> None:
+        """
+        等待队列中所有待处理的回调完成，然后停止 worker
+        
+        在关闭监听器时调用，确保所有弹幕回调都已完成，避免资源泄漏
+        
+        Args:
+            timeout: 等待超时时间（秒），超时后强制取消剩余任务
+        """
+        # 先把还在合并窗口里的系统消息放入队列
+        self._flush_system()
+        await self._callbacks.drain(timeout)
+
+
+class DanmakuHandler(QueuedDanmakuHandler):
+    """
+    弹幕处理器
+    
+    处理 Web 接口的各类直播间消息
+    """
+    
+    __slots__ = ("only_system",)
+    
+    def __init__(
+        self,
+        on_danmaku: Callable[[int, str, str, str, UserInfo, bool], Awaitable[None]],
+        filter_system: bool = True,
+        system_batch_ms: int = 0,
+        only_system: bool = False,
+        queue_size: int = _QUEUE_MAXSIZE,
+        worker_count: int = _WORKER_COUNT,
+    ):
+        """
+        Args:
+            on_danmaku: 弹幕回调函数，最后一个参数 is_system 标记是否为系统消息
+            filter_system: 是否过滤系统消息
+            system_batch_ms: 系统消息合并窗口（毫秒），窗口内的多条系统消息合并为一条转发，0 表示不合并
+            only_system: 只处理系统消息，丢弃普通弹幕和 SC
+            queue_size: 弹幕回调队列容量
+            worker_count: 调用弹幕回调的 worker 数量
+        """
+        super().__init__(on_danmaku, filter_system, system_batch_ms, queue_size, worker_count)
+        self.only_system: bool = only_system
         
-        # 注册额外的命令处理器
-        self._CMD_CALLBACK_DICT = self._CMD_CALLBACK_DICT.copy()
-        # 使用 lambda 适配参数：blivedm 调用 callback(self, client, command)
-        # 这里的 self 是 DanmakuHandler 实例
-        self._CMD_CALLBACK_DICT['INTERACT_WORD'] = lambda handler, client, command: self._interact_word_callback(client, command)
-        self._CMD_CALLBACK_DICT['ENTRY_EFFECT'] = lambda handler, client, command: self._entry_effect_callback(client, command)
+        if only_system:
+            # 回调置为 None 时 blivedm 直接跳过，连消息模型都不会解析
+            self._CMD_CALLBACK_DICT = {
+                **self._CMD_CALLBACK_DICT,
+                'DANMU_MSG': None,
+                'SUPER_CHAT_MESSAGE': None,
+            }
 
     def _interact_word_callback(self, client, command):
         return self._on_interact_word(client, InteractWordMessage.from_command(command['data']))
@@ -178,32 +592,22 @@ class DanmakuHandler(blivedm.BaseHandler):
     def _entry_effect_callback(self, client, command):
         return self._on_entry_effect(client, EntryEffectMessage.from_command(command['data']))
     
-    def _create_task(self, coro: Awaitable[None]) -> None:
-        """创建一个被跟踪的异步任务，并处理异常"""
-        task = asyncio.create_task(coro)
-        self._pending_tasks.add(task)
-        
-        def _log_task_exception(t: asyncio.Task) -> None:
-            self._pending_tasks.discard(t)
-            try:
-                exc = t.exception()
-            except asyncio.CancelledError:
-                return
-            
-            if exc:
-                logger.error(
-                    f"回调异常：{exc}",
-                    exc_info=(type(exc), exc, exc.__traceback__)
-                )
-        
-        task.add_done_callback(_log_task_exception)
-
+    # 注册额外的命令处理器（类级别，只构建一次）
+    # blivedm 调用 callback(self, client, command)，普通方法可直接作为回调
+    _CMD_CALLBACK_DICT = {
+        **blivedm.BaseHandler._CMD_CALLBACK_DICT,
+        'INTERACT_WORD': _interact_word_callback,
+        'ENTRY_EFFECT': _entry_effect_callback,
+    }
+    
     def _on_danmaku(self, client: blivedm.BLiveClient, message: web.DanmakuMessage):
         """
         处理弹幕消息
         
         消息结构包含丰富的用户信息
         """
+        if self.only_system:
+            return
         try:
             user_id = message.uid or 0
             uid_crc32 = message.uid_crc32 or ""  # B站的用户身份码
@@ -212,130 +616,80 @@ class DanmakuHandler(blivedm.BaseHandler):
             
             # 调试：使用uid_crc32作为用户标识
             if user_id == 0:
-                logger.debug(
-                    f"UID为0，使用uid_crc32标识用户：{uid_crc32[:8]}..."
+                logger.opt(lazy=True).debug(
+                    "UID为0，使用uid_crc32标识用户：{}...", lambda: uid_crc32[:8]
                 )
             
             # 收集扩展用户信息
-            user_info = {
-                "user_level": message.user_level or 0,
-                "medal_name": message.medal_name or "",
-                "medal_level": message.medal_level or 0,
-                "vip": message.vip or 0,
-                "admin": message.admin or False,
-                "title": message.title or "",
-            }
+            user_info = UserInfo(
+                message.user_level or 0,
+                message.medal_name or "",
+                message.medal_level or 0,
+                message.vip or 0,
+                message.admin or False,
+                message.title or "",
+            )
             
-            logger.debug(f"收到弹幕：[{username}({uid_crc32[:8]})] {content}")
+            # 热路径：DEBUG 未开启时不拼接字符串（切片放进 lazy 回调里）
+            logger.opt(lazy=True).debug(
+                "收到弹幕：[{}({})] {}",
+                lambda: username, lambda: uid_crc32[:8], lambda: content,
+            )
             
-            # 创建异步任务调用回调
-            self._create_task(self.on_danmaku(user_id, uid_crc32, username, content, user_info))
+            # 放入回调队列，由 worker 调用回调
+            self._dispatch(user_id, uid_crc32, username, content, user_info, False)
         
         except Exception as e:
-            logger.error(f"处理弹幕时出错：{e}", exc_info=True)
+            logger.error("处理弹幕时出错：{}", e)
     
     def _on_gift(self, client: blivedm.BLiveClient, message: web.GiftMessage):
         """
         处理礼物消息
         """
         if not self.filter_system:
-            logger.debug(
-                f"收到礼物：{message.uname} 赠送了 {message.gift_name} x{message.num}"
-            )
+            # 多处使用的字段先取到局部变量
+            uname = message.uname
+            gift_name = message.gift_name
+            num = message.num
+            logger.debug("收到礼物：{} 赠送了 {} x{}", uname, gift_name, num)
             
-            content = f"[系统消息] {message.uname} 赠送了 {message.gift_name} x{message.num}"
-            # 简单的用户信息
-            user_info = {
-                "user_level": 0,
-                "medal_name": message.medal_name or "",
-                "medal_level": message.medal_level or 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
+            content = f"{_SYSTEM_PREFIX} {uname} 赠送了 {gift_name} x{num}"
+            # 简单的用户信息：只有粉丝牌字段
+            user_info = UserInfo(
+                0, message.medal_name or "", message.medal_level or 0, 0, False, ""
+            )
             
-            self._create_task(self.on_danmaku(message.uid, "", message.uname, content, user_info))
+            self._emit_system_content(message.uid, uname, content, user_info)
     
     def _on_buy_guard(self, client: blivedm.BLiveClient, message: web.GuardBuyMessage):
         """处理上舰消息"""
         if not self.filter_system:
-            logger.debug(f"收到上舰：{message.username} 开通了 {message.gift_name}")
+            username = message.username
+            gift_name = message.gift_name
+            logger.debug("收到上舰：{} 开通了 {}", username, gift_name)
             
-            content = f"[系统消息] {message.username} 开通了 {message.gift_name}"
+            content = f"{_SYSTEM_PREFIX} {username} 开通了 {gift_name}"
             
-            user_info = {
-                "user_level": 0,
-                "medal_name": "",
-                "medal_level": 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
-            
-            self._create_task(self.on_danmaku(message.uid, "", message.username, content, user_info))
+            self._emit_system_content(message.uid, username, content)
             
+    def _emit_system(self, uid: int, username: str, action: str) -> None:
+        """转发一条 “[系统消息] 用户名 动作” 形式的互动消息"""
+        self._emit_system_content(uid, username, f"{_SYSTEM_PREFIX} {username} {action}")
+    
     def _on_interact_word_v2(self, _client: blivedm.BLiveClient, message: web.InteractWordV2Message):
         """处理进场/关注消息"""
         if not self.filter_system:
-            # msg_type: 1进入, 2关注, 3分享, 4特别关注, 5互粉, 6点赞
-            msg_type_str = "进入直播间"
-            if message.msg_type == 2:
-                msg_type_str = "关注了直播间"
-            elif message.msg_type == 3:
-                msg_type_str = "分享了直播间"
-            elif message.msg_type == 4:
-                msg_type_str = "特别关注了直播间"
-            elif message.msg_type == 5:
-                msg_type_str = "互粉了直播间"
-            elif message.msg_type == 6:
-                msg_type_str = "点赞了直播间"
-                
-            logger.debug(f"交互消息：{message.username} {msg_type_str}")
-            
-            content = f"[系统消息] {message.username} {msg_type_str}"
-            
-            user_info = {
-                "user_level": 0,
-                "medal_name": "",
-                "medal_level": 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
-            
+            msg_type_str = _MSG_TYPE_STR.get(message.msg_type, "进入直播间")
+            logger.debug("交互消息：{} {}", message.username, msg_type_str)
             # InteractWordV2Message 使用 username 字段
-            self._create_task(self.on_danmaku(message.uid, "", message.username, content, user_info))
+            self._emit_system(message.uid, message.username, msg_type_str)
 
     def _on_interact_word(self, _client: blivedm.BLiveClient, message: InteractWordMessage):
         """处理进场/关注消息 (JSON版)"""
         if not self.filter_system:
-            # msg_type: 1进入, 2关注, 3分享, 4特别关注, 5互粉, 6点赞
-            msg_type_str = "进入直播间"
-            if message.msg_type == 2:
-                msg_type_str = "关注了直播间"
-            elif message.msg_type == 3:
-                msg_type_str = "分享了直播间"
-            elif message.msg_type == 4:
-                msg_type_str = "特别关注了直播间"
-            elif message.msg_type == 5:
-                msg_type_str = "互粉了直播间"
-            elif message.msg_type == 6:
-                msg_type_str = "点赞了直播间"
-                
-            logger.debug(f"交互消息(JSON)：{message.uname} {msg_type_str}")
-            
-            content = f"[系统消息] {message.uname} {msg_type_str}"
-            
-            user_info = {
-                "user_level": 0,
-                "medal_name": "",
-                "medal_level": 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
-            
-            self._create_task(self.on_danmaku(message.uid, "", message.uname, content, user_info))
+            msg_type_str = _MSG_TYPE_STR.get(message.msg_type, "进入直播间")
+            logger.debug("交互消息(JSON)：{} {}", message.uname, msg_type_str)
+            self._emit_system(message.uid, message.uname, msg_type_str)
 
     def _on_entry_effect(self, _client: blivedm.BLiveClient, message: EntryEffectMessage):
         """处理进场特效消息"""
@@ -343,31 +697,26 @@ class DanmakuHandler(blivedm.BaseHandler):
             # copy_writing 格式如： "欢迎 舰长 User 进入直播间"
             # 有时 copy_writing 包含 <%User%> 这样的占位符
             # 如果解析出了完整用户名，优先替换占位符以避免名字被屏蔽（如果有的话）
-            content = message.copy_writing
-            if message.uname:
+            copy_writing = message.copy_writing
+            username = message.uname
+            content = copy_writing
+            if username:
                 # 尝试替换 <%...%> 为完整用户名
-                content = re.sub(r'<%.*?%>', message.uname, content)
+                content = _PLACEHOLDER_RE.sub(username, content)
             
             # 如果替换失败或没有占位符，清理残留标记
             content = content.replace("<%", "").replace("%>", "")
             
-            final_content = f"[系统消息] {content}"
+            final_content = f"{_SYSTEM_PREFIX} {content}"
             
-            logger.debug(f"进场特效：{final_content}")
+            logger.debug("进场特效：{}", final_content)
             
-            user_info = {
-                "user_level": 0,
-                "medal_name": "",
-                "medal_level": 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
-            
-            # 优先使用解析出的用户名，否则尝试默认值
-            username = message.uname if message.uname else "舰长/提督"
+            # 优先使用解析出的用户名，其次从文案中提取，都失败时才用默认值
+            if not username:
+                m = _ENTRY_RE.search(copy_writing)
+                username = (m.group("name").strip() if m else "") or "舰长/提督"
             
-            self._create_task(self.on_danmaku(message.uid, "", username, final_content, user_info))
+            self._emit_system_content(message.uid, username, final_content)
     
     def _on_super_chat(self, client: blivedm.BLiveClient, message: web.SuperChatMessage):
         """
@@ -375,64 +724,31 @@ class DanmakuHandler(blivedm.BaseHandler):
         
         SC通常也算作弹幕的一种，可以选择转发
         """
+        if self.only_system:
+            return
         try:
             user_id = message.uid or 0
             uid_crc32 = getattr(message, 'uid_crc32', "")
             username = message.uname
             content = message.message
             
-            logger.info(f"收到SC：[{username}({uid_crc32[:8]})] ¥{message.price} - {content}")
+            logger.info("收到SC：[{}({})] ¥{} - {}", username, uid_crc32[:8], message.price, content)
             
             # SC也转发（带价格标记）
-            sc_content = f"💰¥{message.price} {content}"
+            sc_content = f"{_SC_PREFIX}{message.price} {content}"
             
             # 收集用户信息
-            user_info = {
-                "user_level": message.user_level or 0,
-                "medal_name": message.medal_name or "",
-                "medal_level": message.medal_level or 0,
-                "vip": getattr(message, 'vip', 0),
-                "admin": False,
-                "title": "",
-            }
+            user_info = UserInfo(
+                message.user_level or 0,
+                message.medal_name or "",
+                message.medal_level or 0,
+                getattr(message, 'vip', 0),
+                False,
+                "",
+            )
             
-            # 创建异步任务并跟踪
-            self._create_task(self.on_danmaku(user_id, uid_crc32, username, sc_content, user_info))
+            # 放入回调队列，由 worker 调用回调
+            self._dispatch(user_id, uid_crc32, username, sc_content, user_info, False)
         
         except Exception as e:
-            logger.error(f"处理SC时出错：{e}", exc_info=True)
-    
-    async def wait_all_tasks(self, timeout: float = 5.0) -> None:
-        """
-        等待所有待处理的任务完成
-        
-        在关闭监听器时调用，确保所有弹幕回调都已完成，避免资源泄漏
-        
-        Args:
-            timeout: 等待超时时间（秒），超时后强制取消剩余任务
-        """
-        if not self._pending_tasks:
-            logger.debug("没有待处理的弹幕任务")
-            return
-        
-        task_count = len(self._pending_tasks)
-        logger.info(f"等待 {task_count} 个弹幕处理任务完成...")
-        
-        try:
-            # 等待所有任务完成（return_exceptions=True 避免异常传播）
-            await asyncio.wait_for(
-                asyncio.gather(*self._pending_tasks, return_exceptions=True),
-                timeout=timeout
-            )
-            logger.success(f"✅ {task_count} 个任务已完成")
-        except asyncio.TimeoutError:
-            # 超时后强制取消剩余任务
-            remaining = len(self._pending_tasks)
-            if remaining > 0:
-                logger.warning(f"⚠️ 等待超时，强制取消剩余 {remaining} 个任务")
-                for task in list(self._pending_tasks):
-                    if not task.done():
-                        task.cancel()
-                # 给任务一点时间清理
-                await asyncio.sleep(0.1)
-
+            logger.error("处理SC时出错：{}", e)
@@ -3,14 +3,15 @@ B站Open Live API弹幕监听器 - 获取完整用户信息
 使用B站Open Live API，可以获取未脱敏的用户名和更多信息
 """
 
-import asyncio
 from typing import Callable, Awaitable
 
 import blivedm
 from blivedm.models import open_live as open_models
 from loguru import logger
 
+from .bilibili_listener import QueuedDanmakuHandler, _SC_PREFIX, _SYSTEM_PREFIX, _medal_user_info
 from .config import BilibiliConfig
+from .message_mapper import UserInfo
 
 
 class BilibiliOpenLiveListener:
@@ -25,10 +26,12 @@ class BilibiliOpenLiveListener:
     需要主播权限和身份码
     """
     
+    __slots__ = ("config", "on_danmaku", "filter_system", "client", "handler", "_running")
+    
     def __init__(
         self,
         config: BilibiliConfig,
-        on_danmaku: Callable[[int, str, str, str, dict], Awaitable[None]],
+        on_danmaku: Callable[[int, str, str, str, UserInfo, bool], Awaitable[None]],
         filter_system: bool = True,
     ):
         """
@@ -53,6 +56,9 @@ class BilibiliOpenLiveListener:
         self.handler = OpenLiveDanmakuHandler(
             on_danmaku=on_danmaku,
             filter_system=filter_system,
+            system_batch_ms=config.system_message_batch_ms,
+            queue_size=config.callback_queue_size,
+            worker_count=config.callback_workers,
         )
         self.client.set_handler(self.handler)
         
@@ -68,6 +74,9 @@ class BilibiliOpenLiveListener:
         self._running = True
         logger.info(f"开始监听直播间 {self.config.room_id} 的弹幕（Open Live API）...")
         
+        # 回调 worker 的生命周期与监听保持一致：在这里启动，stop() 时排空并回收
+        self.handler.start_workers()
+        
         try:
             # 启动客户端
             self.client.start()
@@ -87,13 +96,11 @@ class BilibiliOpenLiveListener:
             return
         
         logger.info("正在停止弹幕监听...")
+        # stop_and_close() 返回时客户端已完全停止并关闭，无需再额外等待
         await self.client.stop_and_close()
         
         # 等待所有待处理的弹幕回调任务完成（避免资源泄漏）
         await self.handler.wait_all_tasks(timeout=3.0)
-        
-        # 等待完全停止
-        await asyncio.sleep(0.5)
     
     @property
     def is_running(self) -> bool:
@@ -101,42 +108,23 @@ class BilibiliOpenLiveListener:
         return self._running
 
 
-class OpenLiveDanmakuHandler(blivedm.BaseHandler):
+class OpenLiveDanmakuHandler(QueuedDanmakuHandler):
     """
     Open Live API弹幕处理器
     """
     
-    def __init__(
-        self,
-        on_danmaku: Callable[[int, str, str, str, dict], Awaitable[None]],
-        filter_system: bool = True,
-    ):
-        super().__init__()
-        self.on_danmaku = on_danmaku
-        self.filter_system = filter_system
-        # 跟踪所有待处理的异步任务（防止关闭时被强制取消）
-        self._pending_tasks: set = set()
+    __slots__ = ()
     
-    def _create_task(self, coro: Awaitable[None]) -> None:
-        """创建一个被跟踪的异步任务，并处理异常"""
-        task = asyncio.create_task(coro)
-        self._pending_tasks.add(task)
-        
-        def _log_task_exception(t: asyncio.Task) -> None:
-            self._pending_tasks.discard(t)
-            try:
-                exc = t.exception()
-            except asyncio.CancelledError:
-                return
-            
-            if exc:
-                logger.error(
-                    f"回调异常：{exc}",
-                    exc_info=(type(exc), exc, exc.__traceback__)
-                )
+    def _forward_user_message(self, message, content: str) -> None:
+        """
+        把一条普通用户消息（弹幕 / SC）放入回调队列
         
-        task.add_done_callback(_log_task_exception)
-
+        Open Live 返回真实 UID，不需要 uid_crc32；
+        用户等级、VIP Open Live API 不提供，只收集粉丝牌
+        """
+        user_info = _medal_user_info(message.fan_medal_name, message.fan_medal_level or 0)
+        self._dispatch(message.uid, "", message.uname, content, user_info, False)
+    
     def _on_open_live_danmaku(self, client: blivedm.OpenLiveClient, message: open_models.DanmakuMessage):
         """
         处理Open Live弹幕消息
@@ -144,127 +132,50 @@ class OpenLiveDanmakuHandler(blivedm.BaseHandler):
         优势：获取完整用户信息！
         """
         try:
-            user_id = message.uid  # Open Live API返回真实UID！
-            uid_crc32 = ""  # Open Live不需要用crc32
-            username = message.uname  # 完整的用户名，未脱敏！
             content = message.msg
+            # 完整的用户名（未脱敏）和真实UID！
+            logger.info("收到弹幕：[{}(UID:{})] {}", message.uname, message.uid, content)
             
-            logger.info(f"收到弹幕：[{username}(UID:{user_id})] {content}")
-            
-            # 收集扩展用户信息
-            user_info = {
-                "user_level": 0,  # Open Live API可能不提供
-                "medal_name": message.fan_medal_name or "",
-                "medal_level": message.fan_medal_level or 0,
-                "vip": 0,  # Open Live API可能不提供
-                "admin": False,
-                "title": "",
-            }
-            
-            # 创建异步任务并跟踪
-            self._create_task(self.on_danmaku(user_id, uid_crc32, username, content, user_info))
+            self._forward_user_message(message, content)
         
         except Exception as e:
-            logger.error(f"处理弹幕时出错：{e}", exc_info=True)
+            logger.error("处理弹幕时出错：{}", e)
     
     def _on_open_live_gift(self, client: blivedm.OpenLiveClient, message: open_models.GiftMessage):
         """处理礼物消息"""
         if not self.filter_system:
-            logger.debug(
-                f"收到礼物：{message.uname} 赠送了 {message.gift_name} x{message.gift_num}"
-            )
+            # 多处使用的字段先取到局部变量
+            uname = message.uname
+            gift_name = message.gift_name
+            gift_num = message.gift_num
+            logger.debug("收到礼物：{} 赠送了 {} x{}", uname, gift_name, gift_num)
             
-            content = f"[系统消息] 赠送了 {message.gift_name} x{message.gift_num}"
+            content = f"{_SYSTEM_PREFIX} {uname} 赠送了 {gift_name} x{gift_num}"
             
-            user_info = {
-                "user_level": 0,
-                "medal_name": message.fan_medal_name or "",
-                "medal_level": message.fan_medal_level or 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
+            user_info = _medal_user_info(message.fan_medal_name, message.fan_medal_level or 0)
             
-            self._create_task(self.on_danmaku(message.uid, "", message.uname, content, user_info))
+            self._emit_system_content(message.uid, uname, content, user_info)
     
     def _on_open_live_buy_guard(self, client: blivedm.OpenLiveClient, message: open_models.GuardBuyMessage):
         """处理上舰消息"""
         if not self.filter_system:
-            logger.debug(f"收到上舰：{message.user_info.uname} 开通了舰长")
-            
-            content = f"[系统消息] 开通了舰长"
+            user = message.user_info
+            uname = user.uname
+            logger.debug("收到上舰：{} 开通了舰长", uname)
             
-            user_info = {
-                "user_level": 0,
-                "medal_name": "",
-                "medal_level": 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
+            content = f"{_SYSTEM_PREFIX} {uname} 开通了舰长"
             
-            self._create_task(self.on_danmaku(message.user_info.uid, "", message.user_info.uname, content, user_info))
+            self._emit_system_content(user.uid, uname, content)
     
     def _on_open_live_super_chat(self, client: blivedm.OpenLiveClient, message: open_models.SuperChatMessage):
         """处理醒目留言（SC）"""
         try:
-            user_id = message.uid
-            uid_crc32 = ""
-            username = message.uname
+            rmb = message.rmb
             content = message.message
-            
-            logger.info(f"收到SC：[{username}(UID:{user_id})] ¥{message.rmb} - {content}")
+            logger.info("收到SC：[{}(UID:{})] ¥{} - {}", message.uname, message.uid, rmb, content)
             
             # SC也转发（带价格标记）
-            sc_content = f"💰¥{message.rmb} {content}"
-            
-            # 收集用户信息
-            user_info = {
-                "user_level": 0,
-                "medal_name": message.fan_medal_name or "",
-                "medal_level": message.fan_medal_level or 0,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
-            
-            # 创建异步任务并跟踪
-            self._create_task(self.on_danmaku(user_id, uid_crc32, username, sc_content, user_info))
+            self._forward_user_message(message, f"{_SC_PREFIX}{rmb} {content}")
         
         except Exception as e:
-            logger.error(f"处理SC时出错：{e}", exc_info=True)
-    
-    async def wait_all_tasks(self, timeout: float = 5.0) -> None:
-        """
-        等待所有待处理的任务完成
-        
-        在关闭监听器时调用，确保所有弹幕回调都已完成，避免资源泄漏
-        
-        Args:
-            timeout: 等待超时时间（秒），超时后强制取消剩余任务
-        """
-        if not self._pending_tasks:
-            logger.debug("没有待处理的弹幕任务")
-            return
-        
-        task_count = len(self._pending_tasks)
-        logger.info(f"等待 {task_count} 个弹幕处理任务完成...")
-        
-        try:
-            # 等待所有任务完成（return_exceptions=True 避免异常传播）
-            await asyncio.wait_for(
-                asyncio.gather(*self._pending_tasks, return_exceptions=True),
-                timeout=timeout
-            )
-            logger.success(f"✅ {task_count} 个任务已完成")
-        except asyncio.TimeoutError:
-            # 超时后强制取消剩余任务
-            remaining = len(self._pending_tasks)
-            if remaining > 0:
-                logger.warning(f"⚠️ 等待超时，强制取消剩余 {remaining} 个任务")
-                for task in list(self._pending_tasks):
-                    if not task.done():
-                        task.cancel()
-                # 给任务一点时间清理
-                await asyncio.sleep(0.1)
-
+            logger.error("处理SC时出错：{}", e)
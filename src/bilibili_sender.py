@@ -5,17 +5,55 @@ B站弹幕发送器 - 仙境传声筒
 
 import asyncio
 import time
-from typing import Optional
+from typing import Optional, Type, TYPE_CHECKING
 from pathlib import Path
 
-from bilibili_api import Credential, live
-from bilibili_api.utils.danmaku import Danmaku
 from loguru import logger
-from collections import deque
 
 from .config import BilibiliConfig, Config
 from .credential_refresher import CredentialRefresher
 
+if TYPE_CHECKING:
+    from bilibili_api.utils.danmaku import Danmaku
+
+
+# 回声抑制保留的近期发送条数
+_RECENT_SENT_MAX = 50
+
+# 回复弹幕格式：@用户名：回复内容
+_REPLY_FMT = "@{}：{}".format
+
+# 发送失败后校验凭证的最小间隔（秒）：刚确认过有效就不再重复请求
+_CREDENTIAL_CHECK_INTERVAL = 60.0
+
+# 合并发送：合并后的总长度上限（B站普通用户弹幕长度上限）与分隔符
+_COALESCE_MAX_LEN = 20
+_COALESCE_SEP = " "
+
+# bilibili_api 导入很重（会连带导入一大串依赖），推迟到第一次用到时再导入
+_danmaku_cls: Optional[Type["Danmaku"]] = None
+
+
+def _get_danmaku_cls() -> Type["Danmaku"]:
+    """获取 Danmaku 类（首次调用时导入并缓存）"""
+    global _danmaku_cls
+    if _danmaku_cls is None:
+        from bilibili_api.utils.danmaku import Danmaku
+        _danmaku_cls = Danmaku
+    return _danmaku_cls
+
+
+class _CoalescedSend:
+    """冷却期间待合并发送的一批弹幕"""
+    
+    __slots__ = ("texts", "length", "result")
+    
+    def __init__(self, text: str, result: asyncio.Future):
+        self.texts: list[str] = [text]
+        self.length: int = len(text)
+        # 整批的发送结果，并入这一批的调用方都等它
+        self.result: asyncio.Future = result
+
 
 class BilibiliDanmakuSender:
     """
@@ -32,6 +70,7 @@ class BilibiliDanmakuSender:
         full_config: Optional[Config] = None,
         config_path: Optional[Path] = None,
         enable_auto_refresh: bool = True,
+        coalesce: bool = False,
     ):
         """
         Args:
@@ -40,10 +79,14 @@ class BilibiliDanmakuSender:
             full_config: 完整配置对象（用于保存刷新后的凭证）
             config_path: 配置文件路径
             enable_auto_refresh: 是否启用自动刷新
+            coalesce: 是否合并冷却期间排队的普通弹幕（回复弹幕不合并）
         """
         self.config = config
         self.cooldown = cooldown
         self.enable_auto_refresh = enable_auto_refresh
+        self.coalesce = coalesce
+        
+        from bilibili_api import Credential, live
         
         # 创建凭证
         self.credential = Credential(
@@ -71,14 +114,24 @@ class BilibiliDanmakuSender:
         elif enable_auto_refresh and not full_config:
             logger.warning("⚠️ 未提供完整配置，凭证自动刷新已禁用")
         
-        # 冷却控制
-        self._last_send_time = 0.0
+        # 冷却预约：下一次预计可以发送的时刻（monotonic），调用方据此在锁外先等一段，
+        # 只是提前等待的提示，真正的冷却以 _last_sent_at 为准
+        self._next_send_deadline = 0.0
+        # 上一次发送成功完成的时刻（monotonic），冷却从这里开始计算
+        self._last_sent_at = 0.0
+        # 发送与失败后的凭证刷新串行执行；拿到锁后再补足剩余冷却，
+        # 保证两次发送之间至少间隔 cooldown（发送耗时再长也不会被预约绕过）
         self._send_lock = asyncio.Lock()
+        # 上次确认凭证有效的时刻（monotonic），用于发送失败时跳过重复校验
+        self._credential_checked_at = float("-inf")
+        # 正在等待冷却、还能并入新弹幕的批次（仅合并发送时使用）
+        self._coalesce_batch: Optional[_CoalescedSend] = None
         # 自身账号信息（用于识别"自己发的弹幕"）
         self.self_uid: Optional[int] = None
         self.self_username: Optional[str] = None
         # 近期发送记录：用于在 Web 监听模式下抑制"回声"
-        self._recent_sent = deque(maxlen=50)  # (text, timestamp)
+        # 内容 -> 发送时间（monotonic），dict 保持插入顺序，最早的在最前面
+        self._recent_sent: dict[str, float] = {}
         
         logger.info(f"弹幕发送器初始化完成，目标房间：{config.room_id}")
     
@@ -101,50 +154,122 @@ class BilibiliDanmakuSender:
         Returns:
             是否发送成功
         """
-        async with self._send_lock:
-            # 检查冷却时间
-            elapsed = time.time() - self._last_send_time
+        # 按目标用户判断是否为回复：Open Live 弹幕没有 uid_crc32（为空字符串），不能用它判断
+        is_reply = bool(at_username or at_uid)
+        if self.coalesce and not is_reply:
+            return await self._send_coalesced(content)
+        
+        await self._wait_send_slot()
+        
+        # 构造弹幕内容
+        if is_reply:
+            # B站直播弹幕的@功能有限，使用明显的文本格式
+            # 格式：@用户名：回复内容
+            final_content = _REPLY_FMT(at_username or at_uid, content)
+            # 安全处理 uid_crc32 切片（防止 None 或空字符串）
+            uid_display = at_uid_crc32[:8] if at_uid_crc32 else "Unknown"
+            logger.info("准备发送回复弹幕：{} (目标用户: {}...)", final_content, uid_display)
+        else:
+            final_content = content
+            logger.info("准备发送弹幕：{}", final_content)
+        
+        return await self._send_now(final_content)
+    
+    async def _send_coalesced(self, content: str) -> bool:
+        """
+        合并发送普通弹幕
+        
+        冷却期间到来的弹幕并入同一批，到点后用分隔符拼成一条发送（总长度不超过上限）；
+        不需要等冷却时直接发送，不增加延迟
+        
+        Returns:
+            整批是否发送成功
+        """
+        batch = self._coalesce_batch
+        if batch is not None and batch.length + len(_COALESCE_SEP) + len(content) <= _COALESCE_MAX_LEN:
+            batch.texts.append(content)
+            batch.length += len(_COALESCE_SEP) + len(content)
+            logger.debug("弹幕并入待发送批次：{}", content)
+            # shield：单个调用方被取消不影响整批的发送
+            return await asyncio.shield(batch.result)
+        
+        batch = _CoalescedSend(content, asyncio.get_running_loop().create_future())
+        self._coalesce_batch = batch
+        ok = False
+        try:
+            await self._wait_send_slot()
+            # 到点后关闭批次，之后的弹幕另起一批
+            if self._coalesce_batch is batch:
+                self._coalesce_batch = None
             
-            if elapsed < self.cooldown:
-                wait_time = self.cooldown - elapsed
-                logger.debug(f"冷却中，等待 {wait_time:.1f}秒...")
-                await asyncio.sleep(wait_time)
+            final_content = _COALESCE_SEP.join(batch.texts)
+            if len(batch.texts) > 1:
+                logger.info("准备发送合并弹幕（{} 条）：{}", len(batch.texts), final_content)
+            else:
+                logger.info("准备发送弹幕：{}", final_content)
             
-            # 记录发送开始时间（用于失败重试逻辑）
-            send_start_time = time.time()
+            ok = await self._send_now(final_content)
+            return ok
+        finally:
+            # 被取消或出错时同样要唤醒并入这一批的调用方
+            if self._coalesce_batch is batch:
+                self._coalesce_batch = None
+            batch.result.set_result(ok)
+    
+    async def _wait_send_slot(self) -> None:
+        """
+        预约发送时刻并在锁外提前等待冷却
+        
+        并发调用各自算出自己的等待时间（预约中间没有 await，单线程事件循环下本身就是原子的）；
+        预约只是提前等待的提示，发送前 _send_now 还会按上次发送完成的时刻补足冷却
+        """
+        now = time.monotonic()
+        send_at = max(self._next_send_deadline, now)
+        self._next_send_deadline = send_at + self.cooldown
+        wait_time = send_at - now
+        if wait_time > 0:
+            logger.debug("冷却中，等待 {:.1f}秒...", wait_time)
+            await asyncio.sleep(wait_time)
+    
+    async def _send_now(self, final_content: str) -> bool:
+        """
+        立即发送一条弹幕（冷却已由调用方等待），失败时校验/刷新凭证后重试一次
+        
+        Returns:
+            是否发送成功
+        """
+        async with self._send_lock:
+            # 前一次发送比预期耗时更久时，预约的时刻已经不够，按实际完成时刻补足冷却
+            remaining = self._last_sent_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                logger.debug("冷却中，再等待 {:.1f}秒...", remaining)
+                await asyncio.sleep(remaining)
             
-            # 构造弹幕内容
-            if at_uid_crc32:  # 使用uid_crc32判断是否为回复
-                # B站直播弹幕的@功能有限，使用明显的文本格式
-                # 格式：@用户名：回复内容
-                final_content = f"@{at_username}：{content}"
-                # 安全处理 uid_crc32 切片（防止 None 或空字符串）
-                uid_display = at_uid_crc32[:8] if at_uid_crc32 else "Unknown"
-                logger.info(f"准备发送回复弹幕：{final_content} (目标用户: {uid_display}...)")
-            else:
-                final_content = content
-                logger.info(f"准备发送弹幕：{final_content}")
+            # 弹幕对象只构造一次，刷新凭证后的重试直接复用
+            danmaku_obj = _get_danmaku_cls()(text=final_content)
             
             try:
                 # 发送弹幕（需要Danmaku对象）
-                danmaku_obj = Danmaku(text=final_content)
                 await self.room.send_danmaku(danmaku_obj)
                 
-                # ✅ 成功后才更新时间戳，确保从发送完成时刻开始计算冷却
-                self._last_send_time = time.time()
-                # 记录近期发送内容（用于回声抑制）
-                self._recent_sent.append((final_content, self._last_send_time))
+                self._mark_sent(final_content)
                 
-                logger.success(f"✅ 弹幕发送成功：{final_content}")
+                logger.success("✅ 弹幕发送成功：{}", final_content)
                 return True
             
             except Exception as e:
-                # 发送失败时重置时间戳，允许立即重试
-                self._last_send_time = send_start_time - self.cooldown
-                logger.error(f"❌ 弹幕发送失败：{e}", exc_info=True)
+                # 发送失败不计入冷却（_last_sent_at 不变），已有的预约保持不动
+                logger.error("❌ 弹幕发送失败：{}", e)
                 
                 # 如果启用了自动刷新，进行校验/刷新后尝试重试（不再依赖错误关键字匹配）
-                if self.refresher and self.enable_auto_refresh:
+                # 短时间内已经确认过凭证有效（例如网络抖动导致的连续失败），不再重复校验
+                if (
+                    self.refresher
+                    and self.enable_auto_refresh
+                    and time.monotonic() - self._credential_checked_at < _CREDENTIAL_CHECK_INTERVAL
+                ):
+                    logger.debug("凭证刚确认过有效，跳过本次校验")
+                elif self.refresher and self.enable_auto_refresh:
                     logger.info("检测到发送异常，校验/刷新凭证后重试...")
                     
                     should_refresh = False
@@ -156,37 +281,28 @@ class BilibiliDanmakuSender:
                         else:
                             # 若未建议刷新，则检查是否仍然有效
                             is_valid = await self.credential.check_valid()
-                            if not is_valid:
+                            if is_valid:
+                                self._credential_checked_at = time.monotonic()
+                            else:
                                 should_refresh = True
                     except Exception as check_e:
                         # 检查流程自身失败时，采取保守策略：尝试刷新一次
-                        logger.warning(f"检查凭证状态时出错，将尝试刷新：{check_e}")
+                        logger.warning("检查凭证状态时出错，将尝试刷新：{}", check_e)
                         should_refresh = True
                     
                     if should_refresh:
-                        refresh_success = await self.refresher.refresh_credential()
-                        
-                        if refresh_success:
-                            # 刷新room对象
-                            self.room = live.LiveRoom(
-                                room_display_id=self.config.room_id,
-                                credential=self.credential,
-                            )
-                            
+                        if await self._refresh_credential():
                             logger.info("凭证刷新成功，重试发送...")
                             
                             # 重试一次
                             try:
-                                danmaku_obj = Danmaku(text=final_content)
                                 await self.room.send_danmaku(danmaku_obj)
+                                self._mark_sent(final_content)
                                 
-                                self._last_send_time = time.time()
-                                self._recent_sent.append((final_content, self._last_send_time))
-                                
-                                logger.success(f"✅ 刷新后弹幕发送成功：{final_content}")
+                                logger.success("✅ 刷新后弹幕发送成功：{}", final_content)
                                 return True
                             except Exception as retry_e:
-                                logger.error(f"刷新后重试仍然失败：{retry_e}")
+                                logger.error("刷新后重试仍然失败：{}", retry_e)
                 
                 return False
     
@@ -207,37 +323,13 @@ class BilibiliDanmakuSender:
                 
                 if needs_refresh:
                     logger.info("🔄 凭证即将过期，尝试刷新...")
-                    success = await self.refresher.refresh_credential()
-                    
-                    if success:
+                    if await self._refresh_credential():
                         logger.success("✅ 凭证刷新成功")
-                        # 刷新room对象以使用新凭证
-                        self.room = live.LiveRoom(
-                            room_display_id=self.config.room_id,
-                            credential=self.credential,
-                        )
                     else:
                         logger.warning("⚠️ 凭证刷新失败，继续使用旧凭证")
             
             # 尝试获取用户信息来测试凭证
-            from bilibili_api import user
-            
-            # 通过凭证获取当前用户信息
-            me = user.get_self_info(credential=self.credential)
-            user_info = await me
-            
-            username = user_info.get("name", "未知")
-            # 记录自身账号信息（mid 为用户UID）
-            try:
-                mid_value = user_info.get("mid") or 0
-                mid = int(mid_value)
-            except (TypeError, ValueError) as exc:
-                logger.warning(
-                    f"无法解析当前账号UID，raw_mid={mid_value!r}，将降级为基于内容的回声抑制：{exc}"
-                )
-                mid = 0
-            self.self_uid = mid if mid > 0 else None
-            self.self_username = username or None
+            username = await self._fetch_self_info()
             logger.info(f"✅ 连接测试成功，当前用户：{username}")
             logger.info(f"✅ 目标直播间：{self.config.room_id}")
             
@@ -254,21 +346,10 @@ class BilibiliDanmakuSender:
             if self.refresher and self.enable_auto_refresh:
                 logger.info("尝试刷新凭证后重试...")
                 
-                refresh_success = await self.refresher.refresh_credential()
-                
-                if refresh_success:
-                    # 刷新room对象
-                    self.room = live.LiveRoom(
-                        room_display_id=self.config.room_id,
-                        credential=self.credential,
-                    )
-                    
+                if await self._refresh_credential():
                     # 重试一次
                     try:
-                        from bilibili_api import user
-                        me = user.get_self_info(credential=self.credential)
-                        user_info = await me
-                        username = user_info.get("name", "未知")
+                        username = await self._fetch_self_info()
                         logger.success(f"✅ 刷新后连接成功，当前用户：{username}")
                         
                         # 刷新后重试成功时，同样启动周期性凭证检查
@@ -282,6 +363,70 @@ class BilibiliDanmakuSender:
             logger.error("请检查Cookie是否正确或是否已过期")
             return False
 
+    async def stop(self) -> None:
+        """停止发送器的后台任务（取消并等待定期凭证检查结束）"""
+        if self.refresher:
+            await self.refresher.stop_periodic_check()
+
+    async def _refresh_credential(self) -> bool:
+        """
+        刷新凭证，成功后用新凭证重建直播间对象
+        
+        Returns:
+            是否刷新成功
+        """
+        if not await self.refresher.refresh_credential():
+            return False
+        from bilibili_api import live
+        
+        self.room = live.LiveRoom(
+            room_display_id=self.config.room_id,
+            credential=self.credential,
+        )
+        return True
+
+    async def _fetch_self_info(self) -> str:
+        """
+        通过凭证获取当前账号信息，并记录自身UID/用户名（用于回声抑制）
+        
+        Returns:
+            当前账号用户名
+        """
+        from bilibili_api import user
+        
+        user_info = await user.get_self_info(credential=self.credential)
+        
+        username = user_info.get("name", "未知")
+        # 记录自身账号信息（mid 为用户UID）
+        try:
+            mid_value = user_info.get("mid") or 0
+            mid = int(mid_value)
+        except (TypeError, ValueError) as exc:
+            logger.warning(
+                f"无法解析当前账号UID，raw_mid={mid_value!r}，将降级为基于内容的回声抑制：{exc}"
+            )
+            mid = 0
+        self.self_uid = mid if mid > 0 else None
+        self.self_username = username or None
+        return username
+
+    def _mark_sent(self, content: str) -> None:
+        """发送成功后的记录：从发送完成时刻开始计算冷却，并记下内容用于回声抑制"""
+        sent_at = time.monotonic()
+        self._last_sent_at = sent_at
+        # 发送耗时较长时顺延后续预约
+        self._next_send_deadline = max(self._next_send_deadline, sent_at + self.cooldown)
+        self._remember_sent(content, sent_at)
+
+    def _remember_sent(self, content: str, ts: float) -> None:
+        """记录一条已发送的弹幕，超出上限时淘汰最早的记录"""
+        recent = self._recent_sent
+        # 相同内容重新插入到末尾，保证淘汰顺序与发送顺序一致
+        recent.pop(content, None)
+        recent[content] = ts
+        if len(recent) > _RECENT_SENT_MAX:
+            del recent[next(iter(recent))]
+
     def is_self_message(self, user_id: int, username: str, content: str, *, window_seconds: float = 5.0) -> bool:
         """
         判断一条弹幕是否来自本Bot自身，避免“发出后又被监听到再转发”的回声。
@@ -294,9 +439,8 @@ class BilibiliDanmakuSender:
         # 仅当无法依据UID判断时，才基于近期发送内容做回声抑制
         if not user_id or user_id == 0 or not self.self_uid:
             # 基于近期发送内容判断（Web 监听的回声抑制）
-            now = time.time()
-            for text, ts in list(self._recent_sent):
-                if now - ts <= window_seconds and text == content:
-                    return True
+            ts = self._recent_sent.get(content)
+            if ts is not None and time.monotonic() - ts <= window_seconds:
+                return True
         return False
 
@@ -18,12 +18,29 @@ import json
 import struct
 import time
 import zlib
-from typing import Awaitable, Callable, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional
 
 import aiohttp
 from loguru import logger
 
+try:
+    # orjson 可选：解析更快，且可以直接解析 bytes / memoryview
+    import orjson
+
+    _json_loads = orjson.loads
+    _ORJSON = True
+except ImportError:  # pragma: no cover - 未安装时回退标准库
+    _json_loads = json.loads
+    _ORJSON = False
+
+from .bilibili_listener import (
+    DanmakuCallbackQueue,
+    _SC_PREFIX,
+    _get_shared_session,
+    _medal_user_info,
+)
 from .config import BilibiliConfig
+from .message_mapper import UserInfo
 
 
 # WebSocket 协议常量（与 B 站直播弹幕协议兼容）
@@ -42,6 +59,41 @@ _PROTO_ZLIB = 2
 _PROTO_BROTLI = 3
 
 _HEARTBEAT_INTERVAL = 10.0  # 秒
+# 服务端每次心跳都会回包，连续这么久收不到任何数据就认为连接已死，交给重连逻辑
+_RECEIVE_TIMEOUT = _HEARTBEAT_INTERVAL * 3
+
+# zlib 解压的初始输出缓冲 = 压缩数据长度 × 该倍数（JSON 弹幕批的压缩比大致在这个量级），
+# 让大多数数据包一次解压到位，不用反复扩容输出缓冲
+_ZLIB_BUF_RATIO = 8
+
+
+def _make_packet(
+    body: bytes,
+    op: int,
+    proto_ver: int = _PROTO_JSON,
+    seq: int = 1,
+    _pack=_HEADER_STRUCT.pack,
+) -> bytes:
+    """构造 B 站直播协议数据包。"""
+    return _pack(_HEADER_LEN + len(body), _HEADER_LEN, proto_ver, op, seq) + body
+
+
+# 心跳包内容固定不变，导入时构造一次
+_HEARTBEAT_PACKET = _make_packet(b"{}", _OP_HEARTBEAT)
+
+
+def _open_live_medal(data: dict) -> tuple[str, int]:
+    """取出佩戴中的粉丝牌 (名称, 等级)，未佩戴时返回空牌。"""
+    if not data.get("fans_medal_wearing_status"):
+        return "", 0
+    medal_level = data.get("fans_medal_level") or 0
+    # JSON 解析出来本来就是 int，只有类型不对时才转换
+    if type(medal_level) is not int:
+        try:
+            medal_level = int(medal_level)
+        except (TypeError, ValueError):
+            medal_level = 0
+    return data.get("fans_medal_name") or "", medal_level
 
 
 class BliveChatFatalError(RuntimeError):
@@ -60,13 +112,13 @@ class BliveChatOpenLiveListener:
     - WebSocket 直接连 B 站 Open Live 服务器
     - 解析 LIVE_OPEN_PLATFORM_DM / LIVE_OPEN_PLATFORM_SUPER_CHAT
     - 回调签名与现有监听器保持一致：
-      on_danmaku(user_id: int, uid_crc32: str, username: str, content: str, user_info: dict)
+      on_danmaku(user_id: int, uid_crc32: str, username: str, content: str, user_info: UserInfo)
     """
 
     def __init__(
         self,
         config: BilibiliConfig,
-        on_danmaku: Callable[[int, str, str, str, dict], Awaitable[None]],
+        on_danmaku: Callable[[int, str, str, str, UserInfo], Awaitable[None]],
         filter_system: bool = True,
     ) -> None:
         """
@@ -80,27 +132,28 @@ class BliveChatOpenLiveListener:
         self.filter_system = filter_system
 
         # blive.chat API 相关
-        self._api_base: str = (
-            config.blive_chat_api_base.strip()
-            if getattr(config, "blive_chat_api_base", "")
-            else ""
-        )
-        self._room_key: str = getattr(config, "blive_chat_room_key", "").strip()
+        self._api_base: str = config.blive_chat_api_base.strip()
+        self._room_key: str = config.blive_chat_room_key.strip()
 
         # Open Live 会话信息
         self._game_id: Optional[str] = None
         self._room_owner_open_id: Optional[str] = None
         self._ws_urls: List[str] = []
         self._auth_body: str = ""  # 已序列化的 JSON 字符串
+        self._auth_packet: bytes = b""  # 由 auth_body 构造好的认证包，重连时直接复用
 
         # 运行时状态
         self._session: Optional[aiohttp.ClientSession] = None
         self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
         self._running: bool = False
         self._heartbeat_task: Optional[asyncio.Task] = None
+        # stop() 置位，用来提前结束重连前的等待
+        self._stop_requested = asyncio.Event()
 
-        # 跟踪弹幕回调任务，方便优雅关闭
-        self._pending_tasks: set[asyncio.Task] = set()
+        # 弹幕回调队列：常驻 worker 依次调用回调，关闭时按队列未完成计数等待，不再逐条跟踪任务
+        self._callbacks = DanmakuCallbackQueue(
+            on_danmaku, config.callback_queue_size, config.callback_workers
+        )
 
         if not self._room_key:
             logger.warning(
@@ -129,7 +182,11 @@ class BliveChatOpenLiveListener:
             return
 
         self._running = True
-        self._session = aiohttp.ClientSession()
+        self._stop_requested.clear()
+        self._callbacks.start()
+        # 与 Web 监听器共用同一个 HTTP 会话（连接池、DNS 缓存已调优），重连时复用已有连接；
+        # 会话由进程退出时的 close_shared_session() 统一关闭
+        self._session = _get_shared_session()
         logger.info("开始通过 blive.chat 监听 Open Live 弹幕...")
 
         try:
@@ -149,15 +206,16 @@ class BliveChatOpenLiveListener:
                 except Exception as e:
                     logger.error(f"BliveChat Open Live 监听异常：{e}", exc_info=True)
 
-                # 若仍处于运行状态，则等待一小段时间后尝试重连
+                # 若仍处于运行状态，则等待一小段时间后尝试重连（期间 stop() 会立即打断等待）
                 if self._running:
-                    await asyncio.sleep(5.0)
+                    try:
+                        await asyncio.wait_for(self._stop_requested.wait(), timeout=5.0)
+                    except asyncio.TimeoutError:
+                        pass
         finally:
             self._running = False
             await self._close_websocket()
-            if self._session is not None:
-                await self._session.close()
-                self._session = None
+            self._session = None
             logger.info("BliveChat Open Live 监听器已退出")
 
     async def stop(self) -> None:
@@ -168,17 +226,9 @@ class BliveChatOpenLiveListener:
 
         logger.info("正在停止 BliveChat Open Live 监听器...")
         self._running = False
+        self._stop_requested.set()
         await self._close_websocket()
         await self.wait_all_tasks(timeout=3.0)
-        # 尝试关闭 HTTP 会话（兜底，正常情况下由 start() 的 finally 关闭）
-        if self._session is not None:
-            try:
-                await self._session.close()
-            except Exception as e:
-                logger.warning(f"关闭 BliveChat HTTP 会话时出错：{e}")
-            self._session = None
-        # 稍微等待一下网络层完全关闭
-        await asyncio.sleep(0.2)
 
     # ----------------------------------------------------------------------
     # 内部主流程
@@ -261,7 +311,7 @@ class BliveChatOpenLiveListener:
         async with self._session.post(url, json=payload, headers=headers, timeout=10) as resp:
             text = await resp.text()
             try:
-                data = json.loads(text)
+                data = _json_loads(text)
             except json.JSONDecodeError:
                 raise RuntimeError(f"blive.chat start_game 返回非法 JSON：{text!r}")
 
@@ -291,6 +341,12 @@ class BliveChatOpenLiveListener:
         self._ws_urls = [u for u in ws_info.get("wss_link", []) if u]
         # 注意：auth_body 是已序列化的 JSON 字符串，不是 dict
         self._auth_body = ws_info.get("auth_body") or ""
+        # auth_body 已经是 JSON 字符串，直接编码即可
+        self._auth_packet = (
+            _make_packet(self._auth_body.encode("utf-8"), _OP_AUTH, proto_ver=_PROTO_JSON)
+            if self._auth_body
+            else b""
+        )
         self._room_owner_open_id = anchor_info.get("open_id") or None
 
         if not self._ws_urls or not self._auth_body:
@@ -321,7 +377,7 @@ class BliveChatOpenLiveListener:
             async with self._session.post(url, json=payload, timeout=10) as resp:
                 text = await resp.text()
                 try:
-                    data = json.loads(text)
+                    data = _json_loads(text)
                 except json.JSONDecodeError:
                     logger.warning(f"blive.chat end_game 返回非法 JSON：{text!r}")
                     self._game_id = None
@@ -351,7 +407,10 @@ class BliveChatOpenLiveListener:
         await self._close_websocket()
 
         logger.info(f"连接 Open Live WebSocket：{ws_url}")
-        async with self._session.ws_connect(ws_url, autoping=False) as ws:
+        # compress=0：业务层已经 zlib/brotli 压缩过，不再协商传输层 permessage-deflate
+        async with self._session.ws_connect(
+            ws_url, autoping=False, compress=0, receive_timeout=_RECEIVE_TIMEOUT
+        ) as ws:
             self._ws = ws
             # 发送认证包
             await self._send_auth()
@@ -416,21 +475,17 @@ class BliveChatOpenLiveListener:
 
     async def _send_auth(self) -> None:
         """发送认证数据包。"""
-        if self._ws is None or not self._auth_body:
+        if self._ws is None or not self._auth_packet:
             return
 
-        # auth_body 已经是 JSON 字符串，直接编码即可
-        payload = self._auth_body.encode("utf-8")
-        packet = self._make_packet(payload, _OP_AUTH, proto_ver=_PROTO_JSON)
-        await self._ws.send_bytes(packet)
-        logger.debug(f"已发送 Open Live 认证包，长度={len(payload)}")
+        await self._ws.send_bytes(self._auth_packet)
+        logger.debug("已发送 Open Live 认证包，长度={}", len(self._auth_packet) - _HEADER_LEN)
 
     async def _heartbeat_loop(self) -> None:
         """周期性发送心跳包。"""
         while self._running and self._ws is not None:
             try:
-                packet = self._make_packet(b"{}", _OP_HEARTBEAT, proto_ver=_PROTO_JSON)
-                await self._ws.send_bytes(packet)
+                await self._ws.send_bytes(_HEARTBEAT_PACKET)
             except asyncio.CancelledError:
                 raise
             except Exception as e:
@@ -439,23 +494,24 @@ class BliveChatOpenLiveListener:
 
             await asyncio.sleep(_HEARTBEAT_INTERVAL)
 
-    @staticmethod
-    def _make_packet(body: bytes, op: int, proto_ver: int = _PROTO_JSON, seq: int = 1) -> bytes:
-        """构造 B 站直播协议数据包。"""
-        pack_len = _HEADER_LEN + len(body)
-        header = _HEADER_STRUCT.pack(pack_len, _HEADER_LEN, proto_ver, op, seq)
-        return header + body
+    def _handle_ws_message(self, data: bytes | memoryview) -> None:
+        """解析 WebSocket 二进制数据（也用于解析解压后的内层数据包）。"""
+        # 包体按 memoryview 切片传下去，不再每个包复制一份 bytes；
+        # 解压出来的数据递归进来时同样只包一层视图，内层数据包也不复制
+        view = memoryview(data)
+        total = len(view)
+        if total < _HEADER_LEN:
+            return
 
-    def _handle_ws_message(self, data: bytes) -> None:
-        """解析 WebSocket 二进制数据。"""
+        # 循环里用到的属性和全局名先绑定到局部变量，一个 zlib 包里往往有几十个数据包
+        unpack_from = _HEADER_STRUCT.unpack_from
+        handle_business = self._handle_business_message
+        log_trace = logger.trace
         offset = 0
-        total = len(data)
 
         while offset + _HEADER_LEN <= total:
             try:
-                pack_len, header_len, proto_ver, op, _seq = _HEADER_STRUCT.unpack_from(
-                    data, offset
-                )
+                pack_len, header_len, proto_ver, op, _seq = unpack_from(view, offset)
             except struct.error:
                 logger.warning("解析 Open Live 数据包头失败，剩余数据长度不足")
                 return
@@ -466,38 +522,44 @@ class BliveChatOpenLiveListener:
                 )
                 return
 
-            body = data[offset + header_len : offset + pack_len]
+            body = view[offset + header_len : offset + pack_len]
 
-            logger.debug(
-                f"收到 Open Live 数据包：op={op}, proto_ver={proto_ver}, pack_len={pack_len}"
+            # 逐包日志用 TRACE：低于最低日志级别时 loguru 一进来就返回，DEBUG 日志里也不会刷屏
+            log_trace(
+                "收到 Open Live 数据包：op={}, proto_ver={}, pack_len={}", op, proto_ver, pack_len
             )
 
-            if op in (_OP_SEND_MSG, _OP_AUTH_REPLY):
-                self._handle_business_message(proto_ver, op, body)
+            if op == _OP_SEND_MSG or op == _OP_AUTH_REPLY:
+                handle_business(proto_ver, op, body)
             elif op == _OP_HEARTBEAT_REPLY:
                 # 心跳回应，可用于统计在线人数，这里暂时仅做日志
                 logger.debug("收到 Open Live 心跳回应")
             else:
-                logger.debug(f"收到未知 op={op} 的 Open Live 数据包，忽略")
+                logger.debug("收到未知 op={} 的 Open Live 数据包，忽略", op)
 
             offset += pack_len
 
-    def _handle_business_message(self, proto_ver: int, op: int, body: bytes) -> None:
-        """根据 proto_ver 解析业务数据。"""
+    def _handle_business_message(self, proto_ver: int, op: int, body: memoryview) -> None:
+        """根据 proto_ver 解析业务数据（body 是整段数据的切片视图）。"""
         if proto_ver in (_PROTO_JSON, _PROTO_INT):
             if not body:
                 return
             try:
-                text = body.decode("utf-8", errors="ignore")
-                logger.debug(
-                    f"Open Live 业务消息：op={op}, text_snippet={text[:200]!r}"
+                # 切片、解码和 repr 只在 TRACE 开启时才执行
+                logger.opt(lazy=True).trace(
+                    "Open Live 业务消息：op={}, text_snippet={}",
+                    lambda: op,
+                    lambda: repr(str(body[:200], "utf-8", "ignore")),
                 )
-                self._handle_json_payload(op, text)
+                self._handle_json_payload(op, body)
             except Exception as e:
                 logger.error(f"解析 Open Live JSON 数据失败：{e}")
         elif proto_ver == _PROTO_ZLIB:
             try:
-                decompressed = zlib.decompress(body)
+                # 每个 zlib 包都是独立的完整数据流，不能复用同一个 decompressobj 连续喂入
+                decompressed = zlib.decompress(
+                    body, bufsize=max(len(body) * _ZLIB_BUF_RATIO, zlib.DEF_BUF_SIZE)
+                )
             except Exception as e:
                 logger.error(f"解压 Open Live zlib 数据失败：{e}")
                 return
@@ -509,20 +571,23 @@ class BliveChatOpenLiveListener:
                 logger.error(f"收到 brotli 编码的 Open Live 数据，但未安装 brotli 库：{e}")
                 return
             try:
-                decompressed = brotli.decompress(body)  # type: ignore[attr-defined]
+                # 部分 brotli 绑定只接受 bytes
+                decompressed = brotli.decompress(bytes(body))  # type: ignore[attr-defined]
             except Exception as e:
                 logger.error(f"解压 Open Live brotli 数据失败：{e}")
                 return
             self._handle_ws_message(decompressed)
         else:
-            logger.debug(f"未知的 Open Live proto_ver={proto_ver}，忽略")
+            logger.debug("未知的 Open Live proto_ver={}，忽略", proto_ver)
 
-    def _handle_json_payload(self, op: int, text: str) -> None:
-        """处理已经解码出的 JSON 文本。"""
+    def _handle_json_payload(self, op: int, body: memoryview) -> None:
+        """处理 JSON 业务数据（body 为原始字节视图）。"""
         try:
-            payload = json.loads(text)
+            # orjson 直接解析字节，省掉一次 UTF-8 解码；标准库需要先解码成文本
+            payload = _json_loads(body if _ORJSON else str(body, "utf-8", "ignore"))
         except json.JSONDecodeError:
-            logger.warning(f"Open Live 收到非 JSON 文本：{text!r}")
+            # orjson.JSONDecodeError 也是 json.JSONDecodeError 的子类
+            logger.warning(f"Open Live 收到非 JSON 文本：{str(body, 'utf-8', 'ignore')!r}")
             return
 
         if op == _OP_AUTH_REPLY:
@@ -533,109 +598,79 @@ class BliveChatOpenLiveListener:
                 logger.info("Open Live 认证成功")
             return
 
-        cmd_full = payload.get("cmd", "") or ""
-        cmd = cmd_full.split(":", 1)[0]  # 去掉可能的后缀
-        data = payload.get("data") or {}
+        cmd = payload.get("cmd") or ""
+        handler = self._CMD_HANDLERS.get(cmd)
+        if handler is None and ":" in cmd:
+            # 带后缀的命令去掉后缀再查一次（绝大多数命令没有后缀，不用每次都 split）
+            cmd = cmd.split(":", 1)[0]
+            handler = self._CMD_HANDLERS.get(cmd)
 
-        if cmd == "LIVE_OPEN_PLATFORM_DM":
-            self._handle_open_dm(data)
-        elif cmd == "LIVE_OPEN_PLATFORM_SUPER_CHAT":
-            self._handle_open_super_chat(data)
-        else:
+        if handler is None:
             # 其他命令暂时仅做调试日志
-            logger.debug(f"忽略 Open Live 命令：{cmd}")
+            logger.debug("忽略 Open Live 命令：{}", cmd)
+            return
+        handler(self, payload.get("data") or {})
 
     # ----------------------------------------------------------------------
     # 业务消息 -> 统一弹幕回调
     # ----------------------------------------------------------------------
 
-    def _create_task(self, coro: Awaitable[None]) -> None:
-        """创建一个被跟踪的异步任务，并记录异常。"""
-        task = asyncio.create_task(coro)
-        self._pending_tasks.add(task)
-
-        def _on_done(t: asyncio.Task) -> None:
-            self._pending_tasks.discard(t)
-            try:
-                exc = t.exception()
-            except asyncio.CancelledError:
-                return
-            if exc:
-                logger.error("BliveChat Open Live 回调异常：{}", exc, exc_info=True)
-
-        task.add_done_callback(_on_done)
+    # 这两个处理函数只做字典取值，不再包一层 try：真有意外异常时，
+    # 由 _handle_business_message 外层统一记录，不影响后续数据包
 
     def _handle_open_dm(self, data: dict) -> None:
         """处理 LIVE_OPEN_PLATFORM_DM（普通弹幕）。"""
-        try:
-            username = data.get("uname") or ""
-            content = data.get("msg") or ""
+        username = data.get("uname") or ""
+        content = data.get("msg") or ""
 
-            # 如果是回复类型，前面补上 @xxx
-            reply_uname = data.get("reply_uname") or ""
-            if reply_uname:
-                content = f"@{reply_uname} {content}"
+        # 如果是回复类型，前面补上 @xxx
+        reply_uname = data.get("reply_uname") or ""
+        if reply_uname:
+            content = f"@{reply_uname} {content}"
 
-            open_id = str(data.get("open_id") or "")
+        open_id = data.get("open_id") or ""
 
-            # 粉丝牌信息
-            medal_name = ""
-            medal_level = 0
-            if data.get("fans_medal_wearing_status"):
-                medal_name = data.get("fans_medal_name") or ""
-                medal_level = int(data.get("fans_medal_level") or 0)
-
-            user_info = {
-                "user_level": 0,
-                "medal_name": medal_name,
-                "medal_level": medal_level,
-                "vip": 0,
-                "admin": bool(data.get("is_admin", False)),
-                "title": "",
-            }
-
-            # Open Live 只提供 open_id，我们放到 uid_crc32 字段里统一传递
-            user_id = 0
-            uid_crc32 = open_id
-
-            logger.debug(f"BliveChat Open Live 弹幕：[{username}] {content}")
-            self._create_task(self.on_danmaku(user_id, uid_crc32, username, content, user_info))
-        except Exception as e:
-            logger.error(f"处理 Open Live DM 消息失败：{e}", exc_info=True)
+        # 粉丝牌信息
+        medal_name, medal_level = _open_live_medal(data)
+
+        if data.get("is_admin"):
+            # 按位置传参：user_level、vip 恒为 0
+            user_info = UserInfo(0, medal_name, medal_level, 0, True)
+        else:
+            user_info = _medal_user_info(medal_name, medal_level)
+
+        # Open Live 只提供 open_id，我们放到 uid_crc32 字段里统一传递
+        user_id = 0
+        uid_crc32 = open_id
+
+        logger.debug("BliveChat Open Live 弹幕：[{}] {}", username, content)
+        self._callbacks.put(user_id, uid_crc32, username, content, user_info)
 
     def _handle_open_super_chat(self, data: dict) -> None:
         """处理 LIVE_OPEN_PLATFORM_SUPER_CHAT（醒目留言）。"""
-        try:
-            username = data.get("uname") or ""
-            content = data.get("message") or ""
-            price = data.get("rmb", data.get("price", 0))
+        username = data.get("uname") or ""
+        content = data.get("message") or ""
+        price = data.get("rmb", data.get("price", 0))
 
-            open_id = str(data.get("open_id") or "")
+        open_id = data.get("open_id") or ""
 
-            medal_name = ""
-            medal_level = 0
-            if data.get("fans_medal_wearing_status"):
-                medal_name = data.get("fans_medal_name") or ""
-                medal_level = int(data.get("fans_medal_level") or 0)
-
-            sc_content = f"💰¥{price} {content}"
-
-            user_info = {
-                "user_level": 0,
-                "medal_name": medal_name,
-                "medal_level": medal_level,
-                "vip": 0,
-                "admin": False,
-                "title": "",
-            }
-
-            user_id = 0
-            uid_crc32 = open_id
-
-            logger.info(f"BliveChat Open Live SC：[{username}] ¥{price} - {content}")
-            self._create_task(self.on_danmaku(user_id, uid_crc32, username, sc_content, user_info))
-        except Exception as e:
-            logger.error(f"处理 Open Live SC 消息失败：{e}", exc_info=True)
+        medal_name, medal_level = _open_live_medal(data)
+
+        sc_content = f"{_SC_PREFIX}{price} {content}"
+
+        user_info = _medal_user_info(medal_name, medal_level)
+
+        user_id = 0
+        uid_crc32 = open_id
+
+        logger.info("BliveChat Open Live SC：[{}] ¥{} - {}", username, price, content)
+        self._callbacks.put(user_id, uid_crc32, username, sc_content, user_info)
+
+    # 命令 -> 处理函数（类级别，只构建一次）
+    _CMD_HANDLERS: Dict[str, Callable[["BliveChatOpenLiveListener", dict], None]] = {
+        "LIVE_OPEN_PLATFORM_DM": _handle_open_dm,
+        "LIVE_OPEN_PLATFORM_SUPER_CHAT": _handle_open_super_chat,
+    }
 
     # ----------------------------------------------------------------------
     # 任务收尾
@@ -643,30 +678,8 @@ class BliveChatOpenLiveListener:
 
     async def wait_all_tasks(self, timeout: float = 5.0) -> None:
         """
-        等待所有待处理的弹幕回调任务完成。
+        等待所有待处理的弹幕回调完成，然后停止回调 worker。
 
         在关闭监听器时调用，确保资源不泄漏。
         """
-        if not self._pending_tasks:
-            logger.debug("BliveChat Open Live 无待处理任务")
-            return
-
-        task_count = len(self._pending_tasks)
-        logger.info(f"等待 {task_count} 个 BliveChat Open Live 弹幕任务完成...")
-
-        try:
-            await asyncio.wait_for(
-                asyncio.gather(*self._pending_tasks, return_exceptions=True),
-                timeout=timeout,
-            )
-            logger.success(f"✅ BliveChat Open Live 任务已全部完成 ({task_count} 个)")
-        except asyncio.TimeoutError:
-            remaining = len(self._pending_tasks)
-            if remaining > 0:
-                logger.warning(f"⚠️ 等待超时，强制取消剩余 {remaining} 个任务")
-                for task in list(self._pending_tasks):
-                    if not task.done():
-                        task.cancel()
-                await asyncio.sleep(0.1)
-
-
+        await self._callbacks.drain(timeout)
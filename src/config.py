@@ -3,12 +3,17 @@
 负责加载和验证所有配置项，确保"仙境参数"不出错
 """
 
+import os
+import shutil
 from pathlib import Path
 from typing import Optional
 
 import yaml
 from pydantic import BaseModel, Field, field_validator
 
+# 有 libyaml 时用 C 实现的解析器，快得多；没有时回退纯 Python 实现
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 class BilibiliConfig(BaseModel):
     """B站直播相关配置"""
@@ -39,6 +44,25 @@ class BilibiliConfig(BaseModel):
         default="",
         description="blive.chat API 基地址，留空则自动从 https://api1.blive.chat/api/endpoints 获取",
     )
+
+    # 系统消息合并窗口（Web / Open Live 监听器，未过滤系统消息时生效）
+    system_message_batch_ms: int = Field(
+        default=500,
+        ge=0,
+        description="系统消息合并窗口（毫秒），窗口内的进场/关注/礼物等消息合并成一条转发，0 表示不合并",
+    )
+    
+    # 弹幕回调队列（所有监听器共用这两个参数）
+    callback_queue_size: int = Field(
+        default=4096,
+        ge=1,
+        description="弹幕回调队列容量，积压超过容量时丢弃新消息",
+    )
+    callback_workers: int = Field(
+        default=4,
+        ge=1,
+        description="并发调用弹幕回调的 worker 数量",
+    )
     
     @field_validator("room_id")
     @classmethod
@@ -94,10 +118,23 @@ class BotConfig(BaseModel):
         default=1.0, 
         description="发送弹幕的冷却时间（秒），防止被红心女王砍头"
     )
+    danmaku_coalesce: bool = Field(
+        default=False,
+        description="冷却期间排队的普通弹幕合并成一条发送（总长度不超过20字，回复弹幕不合并）"
+    )
+    telegram_batch_ms: int = Field(
+        default=0,
+        ge=0,
+        description="转发到TG的合并窗口（毫秒），窗口内的弹幕合并成一条TG消息，0 表示逐条转发",
+    )
     message_cache_size: int = Field(
         default=100,
         description="消息映射缓存大小"
     )
+    message_cache_file: str = Field(
+        default="",
+        description="消息映射持久化文件，关闭时保存、启动时恢复，重启后仍能回复之前的弹幕；留空表示不持久化"
+    )
 
 
 class Config(BaseModel):
@@ -108,6 +145,11 @@ class Config(BaseModel):
     bot: BotConfig = Field(default_factory=BotConfig)
 
 
+# load_config 的解析结果缓存：绝对路径 -> (文件修改时间, 配置)
+# 缓存里的配置只作为模板，每次返回深拷贝：调用方（例如凭证刷新）会原地修改返回的配置
+_load_cache: dict[str, tuple[int, Config]] = {}
+
+
 def load_config(config_path: Optional[Path] = None) -> Config:
     """
     加载配置文件
@@ -131,11 +173,20 @@ def load_config(config_path: Optional[Path] = None) -> Config:
             f"请复制 config.yaml.example 并填写必要信息"
         )
     
+    # 文件没变（路径与修改时间相同）时复用上次解析好的配置，省掉 YAML 解析和校验
+    path_key = str(config_path.resolve())
+    mtime = config_path.stat().st_mtime_ns
+    cached = _load_cache.get(path_key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1].model_copy(deep=True)
+    
     try:
         with open(config_path, "r", encoding="utf-8") as f:
-            config_data = yaml.safe_load(f)
+            config_data = yaml.load(f, Loader=_YamlLoader)
         
-        return Config(**config_data)
+        config = Config.model_validate(config_data)
+        _load_cache[path_key] = (mtime, config)
+        return config.model_copy(deep=True)
     
     except yaml.YAMLError as e:
         raise ValueError(f"配置文件YAML格式错误：{e}")
@@ -169,8 +220,13 @@ def save_config(config: Config, config_path: Optional[Path] = None) -> None:
     # 转换为字典
     config_dict = config.model_dump()
     
+    # 先写临时文件再原子替换，写到一半崩溃也不会留下残缺的配置文件
+    # 配置里有 SESSDATA 等凭证：临时文件先以 0600 创建，再沿用原文件的权限，
+    # 替换后不会因为 umask 变得比用户设置的更宽松
+    tmp_path = config_path.with_name(config_path.name + ".tmp")
     try:
-        with open(config_path, "w", encoding="utf-8") as f:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as f:
             yaml.safe_dump(
                 config_dict,
                 f,
@@ -178,6 +234,14 @@ def save_config(config: Config, config_path: Optional[Path] = None) -> None:
                 default_flow_style=False,
                 sort_keys=False,
             )
+        if config_path.exists():
+            shutil.copymode(config_path, tmp_path)
+        os.replace(tmp_path, config_path)
     except Exception as e:
+        # 失败时清理临时文件，不留下 config.yaml.tmp
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
         raise ValueError(f"配置保存失败：{e}")
 
@@ -4,14 +4,22 @@ B站凭证自动刷新器 - Cookie续命魔法
 """
 
 import asyncio
-from typing import Optional
+import time
+from typing import Optional, TYPE_CHECKING
 from pathlib import Path
 
-from bilibili_api import Credential
 from loguru import logger
 
 from .config import Config, save_config
 
+if TYPE_CHECKING:
+    # bilibili_api 导入很重，运行时只在真正创建凭证时才导入
+    from bilibili_api import Credential
+
+
+# check_refresh 结果的缓存时间（秒）：短时间内多处同时询问时只请求一次
+_CHECK_REFRESH_TTL = 60.0
+
 
 class CredentialRefresher:
     """
@@ -22,7 +30,7 @@ class CredentialRefresher:
     
     def __init__(
         self,
-        credential: Credential,
+        credential: "Credential",
         config: Config,
         config_path: Optional[Path] = None,
     ):
@@ -37,6 +45,14 @@ class CredentialRefresher:
         self.config_path = config_path or Path("config.yaml")
         self._check_task: Optional[asyncio.Task] = None
         self._running = False
+        # 唤醒定期检查循环：停止或需要立即检查时置位，不必等完整个间隔
+        self._wake = asyncio.Event()
+        # 进行中的刷新：定期检查与发送失败可能同时触发刷新，后来者直接等同一次刷新的结果
+        self._refresh_inflight: Optional[asyncio.Future] = None
+        # 上次 check_refresh 的 (时刻, 结果)，时刻为 monotonic
+        self._check_cache: Optional[tuple[float, bool]] = None
+        # 配置文件写入串行执行，保证后一次保存不会被前一次覆盖
+        self._save_lock = asyncio.Lock()
     
     async def check_and_refresh_if_needed(self) -> bool:
         """
@@ -69,9 +85,14 @@ class CredentialRefresher:
         Returns:
             是否需要刷新
         """
+        cached = self._check_cache
+        if cached is not None and time.monotonic() - cached[0] < _CHECK_REFRESH_TTL:
+            return cached[1]
+        
         try:
             # bilibili-api提供的check_refresh方法会检查是否需要刷新
             needs_refresh = await self.credential.check_refresh()
+            self._check_cache = (time.monotonic(), needs_refresh)
             
             if needs_refresh:
                 logger.info("🔄 凭证即将过期，建议刷新")
@@ -84,11 +105,25 @@ class CredentialRefresher:
     
     async def refresh_credential(self) -> bool:
         """
-        刷新凭证
+        刷新凭证（同一时间只进行一次，并发调用共享同一次刷新的结果）
         
         Returns:
             是否刷新成功
         """
+        inflight = self._refresh_inflight
+        if inflight is None:
+            inflight = self._refresh_inflight = asyncio.ensure_future(self._refresh_once())
+            inflight.add_done_callback(self._clear_refresh_inflight)
+        # shield：某个调用方被取消时不打断刷新本身（旧 cookie 可能已经作废）
+        return await asyncio.shield(inflight)
+    
+    def _clear_refresh_inflight(self, fut: asyncio.Future) -> None:
+        """刷新结束后清除进行中标记"""
+        if self._refresh_inflight is fut:
+            self._refresh_inflight = None
+    
+    async def _refresh_once(self) -> bool:
+        """执行一次凭证刷新"""
         try:
             logger.info("🔄 开始刷新凭证...")
             
@@ -103,6 +138,8 @@ class CredentialRefresher:
             
             # 调用bilibili-api的刷新方法
             await self.credential.refresh()
+            # 凭证已更换，之前的 check_refresh 结果作废
+            self._check_cache = None
             
             logger.success("✅ 凭证刷新成功！")
             
@@ -128,8 +165,9 @@ class CredentialRefresher:
             if self.credential.ac_time_value:
                 self.config.bilibili.ac_time_value = self.credential.ac_time_value
             
-            # 保存到文件
-            save_config(self.config, self.config_path)
+            # 保存到文件：序列化和写盘放到线程里，不卡住事件循环上的弹幕/TG 处理
+            async with self._save_lock:
+                await asyncio.to_thread(save_config, self.config, self.config_path)
             
             logger.success(f"✅ 配置已更新并保存到 {self.config_path}")
         
@@ -149,6 +187,7 @@ class CredentialRefresher:
             return
         
         self._running = True
+        self._wake.clear()
         self._check_task = asyncio.create_task(
             self._periodic_check_loop(interval_hours)
         )
@@ -161,16 +200,28 @@ class CredentialRefresher:
             return
         
         self._running = False
+        self._wake.set()
         
-        if self._check_task and not self._check_task.done():
-            self._check_task.cancel()
+        task = self._check_task
+        if task and not task.done():
+            # 空闲等待中的循环被唤醒后会自己退出；正在检查（网络请求中）则稍等片刻，超时再取消
             try:
-                await self._check_task
-            except asyncio.CancelledError:
-                pass
+                await asyncio.wait_for(asyncio.shield(task), timeout=2.0)
+            except asyncio.TimeoutError:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._check_task = None
         
         logger.info("定期凭证检查任务已停止")
     
+    def trigger_check_now(self) -> None:
+        """立即执行一次定期检查（不等待检查完成；定期检查未启动时忽略）"""
+        if self._running:
+            self._wake.set()
+    
     async def _periodic_check_loop(self, interval_hours: float) -> None:
         """
         定期检查循环
@@ -179,8 +230,12 @@ class CredentialRefresher:
         
         while self._running:
             try:
-                # 等待间隔时间
-                await asyncio.sleep(interval_seconds)
+                # 等待间隔时间；stop_periodic_check() / trigger_check_now() 会提前唤醒
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
                 
                 if not self._running:
                     break
@@ -229,6 +284,8 @@ async def create_refresher_from_config(
     Returns:
         刷新器实例
     """
+    from bilibili_api import Credential
+    
     # 创建Credential对象
     credential = Credential(
         sessdata=config.bilibili.sessdata,
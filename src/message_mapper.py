@@ -3,22 +3,36 @@
 维护TG消息与B站弹幕发送者的映射关系，让回复能找到正确的目标
 """
 
-from collections import OrderedDict
-from dataclasses import dataclass
-from typing import Optional
+import json
+import os
+import time
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import NamedTuple, Optional
 
 from loguru import logger
 
 
-@dataclass
+class UserInfo(NamedTuple):
+    """弹幕发送者的扩展用户信息（不可变，可安全共享）"""
+    
+    user_level: int = 0  # 用户等级
+    medal_name: str = ""  # 粉丝牌名称
+    medal_level: int = 0  # 粉丝牌等级
+    vip: int = 0  # VIP状态 (0=非VIP, 1=月费, 2=年费)
+    admin: bool = False  # 是否管理员
+    title: str = ""  # 头衔
+
+
+@dataclass(frozen=True, slots=True)
 class DanmakuInfo:
-    """弹幕信息"""
+    """弹幕信息（不可变；用 __slots__ 省掉每条映射的 __dict__）"""
     
     user_id: int  # B站用户UID（可能为0）
     uid_crc32: str  # 用户身份码（B站隐私保护，用此标识用户）
     username: str  # 用户名
     content: str  # 弹幕内容
-    timestamp: float  # 时间戳
+    timestamp: float  # 记录时刻（time.monotonic()，只用于比较先后/新旧，不是墙钟时间）
     
     # 扩展用户信息
     user_level: int = 0  # 用户等级
@@ -29,11 +43,16 @@ class DanmakuInfo:
     title: str = ""  # 头衔
 
 
+# 持久化时写入文件的字段：timestamp 是进程内的 monotonic 时刻，重启后没有意义，不落盘
+_PERSIST_FIELDS = tuple(f.name for f in fields(DanmakuInfo) if f.name != "timestamp")
+
+
 class MessageMapper:
     """
     消息映射管理器
     
-    使用LRU缓存策略，避免内存无限增长
+    定长环形缓冲 + 索引字典，写满后按插入顺序覆盖最旧的记录，避免内存无限增长
+    （TG消息ID单调递增，按插入顺序淘汰就是按新旧淘汰）
     就像白兔的怀表，只记录最近的时间线
     """
     
@@ -42,8 +61,13 @@ class MessageMapper:
         Args:
             max_size: 最大缓存数量
         """
-        self._map: OrderedDict[int, DanmakuInfo] = OrderedDict()
-        self._max_size = max_size
+        self._max_size = max(1, max_size)
+        # 环形缓冲槽位：(TG消息ID, 弹幕信息)，None 表示空槽
+        self._ring: list[Optional[tuple[int, DanmakuInfo]]] = [None] * self._max_size
+        # TG消息ID -> 槽位下标
+        self._index: dict[int, int] = {}
+        # 下一个写入的槽位（写满后即最旧的记录）
+        self._head = 0
         logger.info(f"消息映射器初始化，缓存容量：{max_size}")
     
     def add_mapping(self, tg_message_id: int, danmaku: DanmakuInfo) -> None:
@@ -54,22 +78,46 @@ class MessageMapper:
             tg_message_id: Telegram消息ID
             danmaku: 弹幕信息
         """
-        # 如果已存在，先删除旧的（更新顺序）
-        if tg_message_id in self._map:
-            del self._map[tg_message_id]
+        # 如果已存在，原地覆盖
+        slot = self._index.get(tg_message_id)
+        if slot is None:
+            self.add_new_mapping(tg_message_id, danmaku)
+            return
         
-        # 添加新映射
-        self._map[tg_message_id] = danmaku
+        self._ring[slot] = (tg_message_id, danmaku)
+        logger.debug(
+            f"更新映射：TG消息 {tg_message_id} -> "
+            f"B站用户 {danmaku.username}({danmaku.user_id})"
+        )
+    
+    def add_new_mapping(self, tg_message_id: int, danmaku: DanmakuInfo) -> None:
+        """
+        添加一条确定不存在的映射（跳过查重）
+        
+        TG消息ID在同一聊天里单调递增、不会复用，刚发出的消息直接走这里；
+        ID可能重复时请用 add_mapping
+        
+        Args:
+            tg_message_id: Telegram消息ID
+            danmaku: 弹幕信息
+        """
+        ring = self._ring
+        slot = self._head
         
-        # LRU淘汰：超出容量时删除最旧的
-        while len(self._map) > self._max_size:
-            oldest_id = next(iter(self._map))
-            removed = self._map.pop(oldest_id)
+        # 槽位被占用时淘汰最旧的记录
+        oldest = ring[slot]
+        if oldest is not None:
+            oldest_id, removed = oldest
+            del self._index[oldest_id]
             logger.debug(
-                f"LRU淘汰：TG消息 {oldest_id} -> "
+                f"淘汰：TG消息 {oldest_id} -> "
                 f"B站用户 {removed.username}({removed.user_id})"
             )
         
+        ring[slot] = (tg_message_id, danmaku)
+        self._index[tg_message_id] = slot
+        self._head = slot + 1 if slot + 1 < self._max_size else 0
+        
         logger.debug(
             f"添加映射：TG消息 {tg_message_id} -> "
             f"B站用户 {danmaku.username}({danmaku.user_id})"
@@ -85,24 +133,82 @@ class MessageMapper:
         Returns:
             弹幕信息，如果不存在则返回None
         """
-        danmaku = self._map.get(tg_message_id)
+        slot = self._index.get(tg_message_id)
         
-        if danmaku:
-            # 访问后移到最后（LRU更新）
-            self._map.move_to_end(tg_message_id)
+        if slot is not None:
+            danmaku = self._ring[slot][1]
             logger.debug(f"查询映射：TG消息 {tg_message_id} -> 找到用户 {danmaku.username}")
-        else:
-            logger.debug(f"查询映射：TG消息 {tg_message_id} -> 未找到（可能已过期）")
+            return danmaku
         
-        return danmaku
+        logger.debug(f"查询映射：TG消息 {tg_message_id} -> 未找到（可能已过期）")
+        return None
     
     def clear(self) -> None:
         """清空所有映射"""
-        count = len(self._map)
-        self._map.clear()
+        count = len(self._index)
+        self._ring = [None] * self._max_size
+        self._index.clear()
+        self._head = 0
         logger.info(f"清空映射缓存，共移除 {count} 条记录")
     
+    def save(self, path: Path) -> int:
+        """
+        把当前映射按从旧到新的顺序保存到JSON文件（先写临时文件再原子替换）
+        
+        不保存 timestamp（monotonic 时刻跨进程无意义），恢复时重新打上
+        
+        Args:
+            path: 保存路径
+        
+        Returns:
+            保存的记录数
+        """
+        head = self._head
+        records = [
+            [tg_message_id, *(getattr(danmaku, name) for name in _PERSIST_FIELDS)]
+            for tg_message_id, danmaku in filter(None, self._ring[head:] + self._ring[:head])
+        ]
+        
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        
+        logger.info(f"保存映射缓存：{len(records)} 条记录 -> {path}")
+        return len(records)
+    
+    def load(self, path: Path) -> int:
+        """
+        从 save() 写出的JSON文件恢复映射，超出容量时只保留最新的记录
+        
+        文件不存在或内容损坏时不恢复任何记录；恢复的记录以当前时刻作为 timestamp
+        
+        Args:
+            path: 保存路径
+        
+        Returns:
+            恢复的记录数
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                records = json.load(f)
+            now = time.monotonic()
+            restored = [
+                (record[0], DanmakuInfo(**dict(zip(_PERSIST_FIELDS, record[1:])), timestamp=now))
+                for record in records[-self._max_size:]
+            ]
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, TypeError, IndexError) as e:
+            logger.warning(f"映射缓存文件 {path} 无法解析，跳过恢复：{e}")
+            return 0
+        
+        for tg_message_id, danmaku in restored:
+            self.add_mapping(tg_message_id, danmaku)
+        
+        logger.info(f"恢复映射缓存：{len(restored)} 条记录 <- {path}")
+        return len(restored)
+    
     def size(self) -> int:
         """获取当前缓存大小"""
-        return len(self._map)
-
+        return len(self._index)
@@ -4,6 +4,7 @@ Telegram Bot处理器 - TG兔子洞管家
 """
 
 import asyncio
+import functools
 import time
 from typing import Optional
 
@@ -18,10 +19,66 @@ from telegram.ext import (
 )
 
 from .config import TelegramConfig
-from .message_mapper import MessageMapper, DanmakuInfo
+from .message_mapper import MessageMapper, DanmakuInfo, UserInfo
 from .bilibili_sender import BilibiliDanmakuSender
 
 
+# 合并转发：一批最多几条、批内分隔符，以及TG单条消息的长度上限
+_BATCH_MAX_ITEMS = 10
+_BATCH_SEP = "\n━━━\n"
+_TG_TEXT_LIMIT = 4096
+
+# 固定的用户标签
+_BADGE_VIP_MONTH = "🔷月费"
+_BADGE_VIP_YEAR = "💎年费"
+_BADGE_ADMIN = "🛡️管理"
+
+_EMPTY_USER_INFO = UserInfo()
+
+# 命令回复文本
+_WELCOME_TEXT = (
+    "🎭 欢迎来到BiliChat Bot！\n\n"
+    "我是连接B站直播间和Telegram的魔法桥~\n\n"
+    "✨ 功能说明：\n"
+    "- 我会自动将直播间弹幕转发给你\n"
+    "- 回复弹幕消息 → 在直播间@原发送者\n"
+    "- 直接发送消息 → 在直播间发送弹幕\n\n"
+    "💡 使用 /help 查看详细帮助\n"
+    "📊 使用 /status 查看运行状态"
+)
+
+_HELP_TEXT = (
+    "📖 使用指南\n\n"
+    "1️⃣ 接收弹幕\n"
+    "Bot会自动推送直播间的弹幕消息\n"
+    "格式：[用户名] 弹幕内容\n\n"
+    "2️⃣ @弹幕发送者\n"
+    "回复Bot发来的弹幕消息，输入你的回复内容\n"
+    "Bot会在直播间@原发送者并发送你的回复\n\n"
+    "3️⃣ 发送弹幕\n"
+    "直接给Bot发送消息（不是回复）\n"
+    "Bot会将你的消息作为弹幕发送到直播间\n\n"
+    "⚠️ 注意事项：\n"
+    "- 弹幕有发送冷却时间，请勿刷屏\n"
+    "- 消息映射有缓存限制，太久的消息可能无法回复\n"
+    "- 请遵守直播间和平台规则"
+)
+
+_STATUS_TMPL = (
+    "📊 Bot运行状态\n\n"
+    "🔗 监听房间：{}\n"
+    "💾 消息缓存：{} 条\n"
+    "⏰ 时间：{}\n"
+    "✅ 状态：正常运行"
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _format_time(second: int) -> str:
+    """按秒格式化本地时间；同一秒内重复调用直接复用上一次的结果"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+
+
 class TelegramBot:
     """
     Telegram Bot管理器
@@ -37,17 +94,31 @@ class TelegramBot:
         config: TelegramConfig,
         bili_sender: BilibiliDanmakuSender,
         message_mapper: MessageMapper,
+        batch_ms: int = 0,
     ):
         """
         Args:
             config: TG配置
             bili_sender: B站弹幕发送器
             message_mapper: 消息映射管理器
+            batch_ms: 转发合并窗口（毫秒），窗口内的弹幕合并成一条TG消息，0 表示逐条转发
         """
         self.config = config
         self.bili_sender = bili_sender
         self.mapper = message_mapper
         
+        # 拼接用户标签的复用缓冲：从填充到 join 之间没有 await，
+        # 多个回调 worker 并发转发时也不会交错使用
+        self._badge_buf: list[str] = []
+        
+        # 允许使用Bot的用户/聊天ID
+        self._allowed_ids: frozenset[int] = frozenset((config.chat_id,))
+        
+        # 合并转发：待发送的 (文本, 弹幕信息)，由 _flush_loop 攒批发送
+        self._batch_delay = batch_ms / 1000
+        self._out_queue: Optional[asyncio.Queue] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        
         # 创建TG应用
         self.app = Application.builder().token(config.bot_token).build()
         
@@ -56,23 +127,43 @@ class TelegramBot:
         
         logger.info("Telegram Bot初始化完成")
     
+    def add_allowed_id(self, chat_id: int) -> None:
+        """运行时追加一个允许使用Bot的用户/聊天ID"""
+        self._allowed_ids = self._allowed_ids | {chat_id}
+    
     def _register_handlers(self) -> None:
         """注册消息处理器"""
-        # 命令处理
-        self.app.add_handler(CommandHandler("start", self._handle_start))
-        self.app.add_handler(CommandHandler("help", self._handle_help))
-        self.app.add_handler(CommandHandler("status", self._handle_status))
+        # 命令处理：一个 CommandHandler 接住所有命令，再按命令名查表分发
+        self._commands = {
+            "start": self._handle_start,
+            "help": self._handle_help,
+            "status": self._handle_status,
+        }
+        self.app.add_handler(CommandHandler(list(self._commands), self._dispatch_command))
         
         # 普通消息处理（包括回复和直接消息）
+        # block=False：发送弹幕要等冷却，不阻塞后续更新的分发，冷却期间的消息才能并入合并发送；
+        # 发送顺序和冷却由发送器自己保证（预约发送时刻在第一次 await 之前完成），映射查询是同步的
         self.app.add_handler(
             MessageHandler(
                 filters.TEXT & filters.ChatType.PRIVATE,
                 self._handle_message,
+                block=False,
             )
         )
         
         logger.debug("消息处理器注册完成")
     
+    async def _dispatch_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """按命令名（去掉 / 和 @bot 后缀）分发到对应的处理函数"""
+        if not update.message or not update.message.text:
+            return
+        
+        command = update.message.text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+        handler = self._commands.get(command)
+        if handler is not None:
+            await handler(update, context)
+    
     async def _handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """处理 /start 命令"""
         # 防御性检查：避免空值解引用崩溃
@@ -80,17 +171,7 @@ class TelegramBot:
             logger.warning("收到无效的 Update 对象（message 或 effective_user 为 None）")
             return
         
-        welcome_text = (
-            "🎭 欢迎来到BiliChat Bot！\n\n"
-            "我是连接B站直播间和Telegram的魔法桥~\n\n"
-            "✨ 功能说明：\n"
-            "- 我会自动将直播间弹幕转发给你\n"
-            "- 回复弹幕消息 → 在直播间@原发送者\n"
-            "- 直接发送消息 → 在直播间发送弹幕\n\n"
-            "💡 使用 /help 查看详细帮助\n"
-            "📊 使用 /status 查看运行状态"
-        )
-        await update.message.reply_text(welcome_text)
+        await update.message.reply_text(_WELCOME_TEXT)
         logger.info(f"用户 {update.effective_user.id} 启动了bot")
     
     async def _handle_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -99,23 +180,7 @@ class TelegramBot:
             logger.warning("收到无效的 Update 对象")
             return
         
-        help_text = (
-            "📖 使用指南\n\n"
-            "1️⃣ 接收弹幕\n"
-            "Bot会自动推送直播间的弹幕消息\n"
-            "格式：[用户名] 弹幕内容\n\n"
-            "2️⃣ @弹幕发送者\n"
-            "回复Bot发来的弹幕消息，输入你的回复内容\n"
-            "Bot会在直播间@原发送者并发送你的回复\n\n"
-            "3️⃣ 发送弹幕\n"
-            "直接给Bot发送消息（不是回复）\n"
-            "Bot会将你的消息作为弹幕发送到直播间\n\n"
-            "⚠️ 注意事项：\n"
-            "- 弹幕有发送冷却时间，请勿刷屏\n"
-            "- 消息映射有缓存限制，太久的消息可能无法回复\n"
-            "- 请遵守直播间和平台规则"
-        )
-        await update.message.reply_text(help_text)
+        await update.message.reply_text(_HELP_TEXT)
         logger.info(f"用户 {update.effective_user.id} 查看了帮助")
     
     async def _handle_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -124,12 +189,10 @@ class TelegramBot:
             logger.warning("收到无效的 Update 对象")
             return
         
-        status_text = (
-            f"📊 Bot运行状态\n\n"
-            f"🔗 监听房间：{self.bili_sender.config.room_id}\n"
-            f"💾 消息缓存：{self.mapper.size()} 条\n"
-            f"⏰ 时间：{time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-            f"✅ 状态：正常运行"
+        status_text = _STATUS_TMPL.format(
+            self.bili_sender.config.room_id,
+            self.mapper.size(),
+            _format_time(int(time.time())),
         )
         await update.message.reply_text(status_text)
         logger.info(f"用户 {update.effective_user.id} 查询了状态")
@@ -151,7 +214,8 @@ class TelegramBot:
         user_id = update.effective_user.id
         
         # 权限检查：只处理配置的chat_id
-        if user_id != self.config.chat_id and message.chat_id != self.config.chat_id:
+        allowed = self._allowed_ids
+        if user_id not in allowed and message.chat_id not in allowed:
             logger.warning(f"拒绝未授权用户 {user_id} 的消息")
             await message.reply_text("❌ 你没有权限使用此Bot")
             return
@@ -236,7 +300,8 @@ class TelegramBot:
         uid_crc32: str,
         username: str,
         content: str,
-        user_info: dict = None,
+        user_info: Optional[UserInfo] = None,
+        is_system: bool = False,
     ) -> Optional[int]:
         """
         转发B站弹幕到TG
@@ -247,54 +312,73 @@ class TelegramBot:
             username: 用户名
             content: 弹幕内容
             user_info: 扩展用户信息
+            is_system: 是否为系统消息（系统消息不带用户名头）
         
         Returns:
-            TG消息ID，失败则返回None
+            TG消息ID，失败则返回None；开启合并转发时只入队，返回None
         """
         try:
-            user_info = user_info or {}
-            
-            # 构建用户标签
-            badges = []
-            
-            # 粉丝牌
-            if user_info.get("medal_name"):
-                medal = f"[{user_info['medal_name']}{user_info.get('medal_level', 0)}]"
-                badges.append(medal)
-            
-            # VIP状态
-            vip_status = user_info.get("vip", 0)
-            if vip_status == 1:
-                badges.append("🔷月费")
-            elif vip_status == 2:
-                badges.append("💎年费")
-            
-            # 管理员
-            if user_info.get("admin"):
-                badges.append("🛡️管理")
-            
-            # 头衔
-            if user_info.get("title"):
-                badges.append(f"「{user_info['title']}」")
-            
-            # 用户等级
-            user_level = user_info.get("user_level", 0)
-            if user_level > 0:
-                badges.append(f"UL{user_level}")
-            
-            # 格式化消息
-            badge_str = " ".join(badges) if badges else ""
+            if user_info is None:
+                user_info = _EMPTY_USER_INFO
+            user_level, medal_name, medal_level, vip, admin, title = user_info
             
             # 根据消息类型决定前缀
             # 如果是系统消息，直接发送内容（不带用户名头）
-            if content.startswith("[系统消息]"):
+            if is_system:
                 text = content
+            elif not (medal_name or vip or admin or title or user_level > 0):
+                # 大多数观众没有任何标签，直接拼接
+                text = f"💬 [{username}]\n{content}"
             else:
-                prefix = "💬 "
-                if badge_str:
-                    text = f"{prefix}{badge_str} [{username}]\n{content}"
+                # 构建用户标签
+                badges = self._badge_buf
+                
+                # 粉丝牌
+                if medal_name:
+                    badges.append(f"[{medal_name}{medal_level}]")
+                
+                # VIP状态
+                if vip == 1:
+                    badges.append(_BADGE_VIP_MONTH)
+                elif vip == 2:
+                    badges.append(_BADGE_VIP_YEAR)
+                
+                # 管理员
+                if admin:
+                    badges.append(_BADGE_ADMIN)
+                
+                # 头衔
+                if title:
+                    badges.append(f"「{title}」")
+                
+                # 用户等级
+                if user_level > 0:
+                    badges.append(f"UL{user_level}")
+                
+                if badges:
+                    text = f"💬 {' '.join(badges)} [{username}]\n{content}"
+                    badges.clear()
                 else:
-                    text = f"{prefix}[{username}]\n{content}"
+                    text = f"💬 [{username}]\n{content}"
+            
+            danmaku_info = DanmakuInfo(
+                user_id=user_id,
+                uid_crc32=uid_crc32,
+                username=username,
+                content=content,
+                timestamp=time.monotonic(),
+                user_level=user_level,
+                medal_name=medal_name,
+                medal_level=medal_level,
+                vip=vip,
+                admin=admin,
+                title=title,
+            )
+            
+            # 合并转发：交给 _flush_loop 攒批发送，不占用回调 worker
+            if self._out_queue is not None:
+                self._out_queue.put_nowait((text, danmaku_info))
+                return None
             
             # 发送到TG
             sent_message = await self.app.bot.send_message(
@@ -304,35 +388,82 @@ class TelegramBot:
             
             # 记录映射（确保在发送成功后立即执行，并捕获异常）
             try:
-                danmaku_info = DanmakuInfo(
-                    user_id=user_id,
-                    uid_crc32=uid_crc32,
-                    username=username,
-                    content=content,
-                    timestamp=time.time(),
-                    user_level=user_info.get("user_level", 0),
-                    medal_name=user_info.get("medal_name", ""),
-                    medal_level=user_info.get("medal_level", 0),
-                    vip=user_info.get("vip", 0),
-                    admin=user_info.get("admin", False),
-                    title=user_info.get("title", ""),
-                )
-                self.mapper.add_mapping(sent_message.message_id, danmaku_info)
+                self.mapper.add_new_mapping(sent_message.message_id, danmaku_info)
             except Exception as map_err:
-                logger.error(f"映射添加失败，消息ID {sent_message.message_id}: {map_err}", exc_info=True)
+                logger.error("映射添加失败，消息ID {}: {}", sent_message.message_id, map_err)
             
             logger.debug(f"转发弹幕到TG：{text}")
             return sent_message.message_id
         
         except Exception as e:
-            logger.error(f"转发弹幕失败：{e}", exc_info=True)
+            logger.error("转发弹幕失败：{}", e)
             return None
     
+    async def _flush_loop(self) -> None:
+        """
+        合并转发循环
+        
+        取到第一条后在合并窗口内继续收集，攒满一批、超出TG长度上限
+        或窗口到期就合并成一条TG消息发送；收到 None 时发完手头这批后退出
+        """
+        queue = self._out_queue
+        loop = asyncio.get_running_loop()
+        carry = None  # 上一批放不下、留给下一批的消息
+        while True:
+            first = carry if carry is not None else await queue.get()
+            carry = None
+            if first is None:
+                return
+            batch = [first]
+            length = len(first[0])
+            deadline = loop.time() + self._batch_delay
+            
+            while len(batch) < _BATCH_MAX_ITEMS:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    await self._send_batch(batch)
+                    return
+                length += len(_BATCH_SEP) + len(item[0])
+                if length > _TG_TEXT_LIMIT:
+                    carry = item
+                    break
+                batch.append(item)
+            
+            await self._send_batch(batch)
+    
+    async def _send_batch(self, batch: list[tuple[str, DanmakuInfo]]) -> None:
+        """发送一批合并的弹幕；合并消息的映射指向最后一条弹幕的发送者"""
+        text = _BATCH_SEP.join(item[0] for item in batch)
+        try:
+            sent_message = await self.app.bot.send_message(
+                chat_id=self.config.chat_id,
+                text=text,
+            )
+            self.mapper.add_new_mapping(sent_message.message_id, batch[-1][1])
+            logger.debug(f"合并转发 {len(batch)} 条弹幕到TG")
+        except Exception as e:
+            logger.error(f"合并转发 {len(batch)} 条弹幕失败：{e}")
+    
+    async def preflight(self) -> None:
+        """
+        预检：初始化应用（会向Telegram获取Bot信息）
+        
+        可以和其他初始化步骤并发执行；重复调用是安全的，
+        start() 里的 initialize() 会直接返回。
+        """
+        await self.app.initialize()
+    
     async def start(self) -> None:
         """启动Bot"""
         logger.info("启动Telegram Bot...")
         
-        # 初始化应用
+        # 初始化应用（若已预检则立即返回）
         await self.app.initialize()
         await self.app.start()
         
@@ -342,23 +473,59 @@ class TelegramBot:
             drop_pending_updates=True,
         )
         
+        # 开启合并转发时启动发送循环
+        if self._batch_delay > 0 and self._flush_task is None:
+            self._out_queue = asyncio.Queue()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        
         logger.success("✅ Telegram Bot已启动")
     
+    async def _stop_flush_loop(self) -> None:
+        """停止合并转发循环：放入结束标记，等它把队列里剩下的弹幕发完"""
+        task, self._flush_task = self._flush_task, None
+        queue, self._out_queue = self._out_queue, None
+        queue.put_nowait(None)
+        try:
+            await asyncio.wait_for(task, timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning("合并转发未能在5秒内发完，剩余弹幕已丢弃")
+            # 显式取消并等它退出，之后停止应用时不会还有发送在途
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    
     async def stop(self) -> None:
-        """停止Bot"""
+        """
+        停止Bot
+        
+        每一步单独兜底：轮询停止失败也要继续 stop/shutdown，
+        否则 Application 内部的任务会残留到事件循环关闭之后
+        """
         logger.info("停止Telegram Bot...")
         
-        try:
-            # 停止轮询
-            if self.app.updater:
-                await self.app.updater.stop()
-            
-            # 停止应用
-            await self.app.stop()
-            await self.app.shutdown()
-            
-            logger.success("✅ Telegram Bot已停止")
+        steps = []
+        # 停止合并转发（要赶在停止应用之前，剩下的弹幕还得靠它发出去）
+        if self._flush_task is not None:
+            steps.append(("停止合并转发", self._stop_flush_loop))
+        # 停止轮询
+        if self.app.updater and self.app.updater.running:
+            steps.append(("停止轮询", self.app.updater.stop))
+        # 停止应用
+        if self.app.running:
+            steps.append(("停止应用", self.app.stop))
+        steps.append(("释放资源", self.app.shutdown))
         
-        except Exception as e:
-            logger.error(f"停止Bot时出错：{e}")
-
+        ok = True
+        for name, step in steps:
+            try:
+                await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                ok = False
+                logger.error(f"停止Bot时出错（{name}）：{e}")
+        
+        if ok:
+            logger.success("✅ Telegram Bot已停止")
@@ -0,0 +1,97 @@
+"""
+弹幕发送器测试：合并发送与冷却
+
+用假的 bilibili_api 模块替换真实直播间，只记录发出的弹幕内容
+"""
+
+import asyncio
+import sys
+import time
+import types
+
+import pytest
+
+from src import bilibili_sender
+from src.bilibili_sender import BilibiliDanmakuSender
+from src.config import BilibiliConfig
+
+
+COOLDOWN = 0.05
+
+
+class FakeRoom:
+    """假直播间：记录每条弹幕的内容和发送时刻"""
+    
+    def __init__(self, *args, **kwargs):
+        self.sent: list[tuple[str, float]] = []
+    
+    async def send_danmaku(self, danmaku) -> None:
+        await asyncio.sleep(0)
+        self.sent.append((danmaku, time.monotonic()))
+
+
+@pytest.fixture
+def sender_factory(monkeypatch):
+    fake_api = types.ModuleType("bilibili_api")
+    fake_api.Credential = lambda **kwargs: object()
+    fake_api.live = types.SimpleNamespace(LiveRoom=FakeRoom)
+    monkeypatch.setitem(sys.modules, "bilibili_api", fake_api)
+    # 弹幕对象直接用文本代替，方便断言
+    monkeypatch.setattr(bilibili_sender, "_get_danmaku_cls", lambda: lambda text: text)
+    
+    config = BilibiliConfig(room_id=1, sessdata="s", bili_jct="j", buvid3="b")
+    
+    def make(coalesce: bool) -> BilibiliDanmakuSender:
+        return BilibiliDanmakuSender(
+            config=config,
+            cooldown=COOLDOWN,
+            enable_auto_refresh=False,
+            coalesce=coalesce,
+        )
+    
+    return make
+
+
+def test_overlapping_sends_are_coalesced(sender_factory):
+    sender = sender_factory(coalesce=True)
+    
+    async def scenario():
+        # 第一条发出后进入冷却，冷却期间重叠到来的两条合并成一条
+        assert await sender.send_danmaku("a")
+        return await asyncio.gather(
+            sender.send_danmaku("b"),
+            sender.send_danmaku("c"),
+        )
+    
+    assert asyncio.run(scenario()) == [True, True]
+    assert [text for text, _ in sender.room.sent] == ["a", "b c"]
+    gap = sender.room.sent[1][1] - sender.room.sent[0][1]
+    assert gap >= COOLDOWN * 0.9
+
+
+def test_reply_without_uid_crc32_is_not_coalesced(sender_factory):
+    sender = sender_factory(coalesce=True)
+    
+    async def scenario():
+        assert await sender.send_danmaku("a")
+        # Open Live 弹幕没有 uid_crc32，回复仍然要单独发送并带上@
+        return await asyncio.gather(
+            sender.send_danmaku("b"),
+            sender.send_danmaku("c", at_uid=0, at_uid_crc32="", at_username="兔子"),
+        )
+    
+    assert asyncio.run(scenario()) == [True, True]
+    assert [text for text, _ in sender.room.sent] == ["a", "b", "@兔子：c"]
+
+
+def test_cooldown_without_coalesce(sender_factory):
+    sender = sender_factory(coalesce=False)
+    
+    async def scenario():
+        return await asyncio.gather(*(sender.send_danmaku(t) for t in "abc"))
+    
+    assert asyncio.run(scenario()) == [True, True, True]
+    sent = sender.room.sent
+    assert [text for text, _ in sent] == ["a", "b", "c"]
+    for prev, cur in zip(sent, sent[1:]):
+        assert cur[1] - prev[1] >= COOLDOWN * 0.9